@@ -0,0 +1,109 @@
+"""Micro-benchmarks for the FallBall client models.
+
+Run from the repository root so the default config.yml is found:
+
+    PYTHONPATH=. python benchmarks/fbclient_models.py
+"""
+import sys
+import timeit
+
+from connector.fbclient import schemas
+from connector.fbclient.client import Client, ClientSchema
+from connector.fbclient.reseller import Reseller, ResellerSchema
+from connector.fbclient.user import User
+
+RESELLERS = 10000
+
+
+def make_client():
+    return Client(Reseller('reseller'), name='client', email='admin@client.fallball.io',
+                  storage={'limit': 10}, users_by_type={'USERS': 5}, postal_code='11111',
+                  country='US', environment='PRODUCTION')
+
+
+def make_resellers_payload(amount):
+    return [{'name': 'reseller-{}'.format(i), 'rid': 'rid-{}'.format(i),
+             'token': 'token-{}'.format(i), 'clients_amount': i,
+             'storage': {'usage': i, 'limit': 1000000}} for i in range(amount)]
+
+
+def report(title, seconds, number):
+    print('{:<45} {:>12.2f} us'.format(title, seconds / number * 1e6))
+
+
+def bench_client_dump(number=10000):
+    client = make_client()
+    report('client dump, new schema per call',
+           timeit.timeit(lambda: ClientSchema().dump(client).data, number=number), number)
+    report('client dump, reused schema',
+           timeit.timeit(lambda: schemas.get(ClientSchema).dump(client).data, number=number),
+           number)
+
+
+def bench_client_load(number=10000):
+    data = schemas.get(ClientSchema).dump(make_client()).data
+    report('client load, new schema per call',
+           timeit.timeit(lambda: ClientSchema().load(data).data, number=number), number)
+    report('client load, reused schema',
+           timeit.timeit(lambda: schemas.get(ClientSchema).load(data).data, number=number),
+           number)
+
+
+def bench_resellers_load(number=5):
+    data = make_resellers_payload(RESELLERS)
+    report('{} resellers load, new schema'.format(RESELLERS),
+           timeit.timeit(lambda: ResellerSchema().load(data, many=True).data, number=number),
+           number)
+    report('{} resellers load, reused schema'.format(RESELLERS),
+           timeit.timeit(lambda: schemas.get(ResellerSchema).load(data, many=True).data,
+                         number=number), number)
+
+
+def bench_resellers_dump(number=5):
+    resellers = schemas.get(ResellerSchema).load(make_resellers_payload(RESELLERS),
+                                                 many=True).data
+    report('{} resellers dump, reused schema'.format(RESELLERS),
+           timeit.timeit(lambda: schemas.get(ResellerSchema).dump(resellers, many=True).data,
+                         number=number), number)
+
+
+def bench_memory(amount=10000):
+    try:
+        import tracemalloc
+    except ImportError:
+        # Python 2 has no tracemalloc, only instance sizes are reported there
+        tracemalloc = None
+
+    reseller = Reseller('reseller')
+    client = make_client()
+    factories = [
+        ('Reseller', 'reseller-{}',
+         lambda text: Reseller(text, rid='rid', token='token')),
+        ('Client', 'client-{}',
+         lambda text: Client(reseller, name=text, email='a@b.io')),
+        ('User', 'user-{}@b.io',
+         lambda text: User(client, email=text, admin=True)),
+    ]
+    for name, template, factory in factories:
+        if tracemalloc is None:
+            print('{:<45} {:>9} bytes'.format('{} instance size'.format(name),
+                                              sys.getsizeof(factory(template.format(0)))))
+            continue
+        # strings and the list are allocated up front, only the objects are measured
+        texts = [template.format(i) for i in range(amount)]
+        objects = [None] * amount
+        tracemalloc.start()
+        for i, text in enumerate(texts):
+            objects[i] = factory(text)
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:<45} {:>9} bytes, {} allocated per object'.format(
+            '{} instance size'.format(name), sys.getsizeof(objects[0]), allocated // amount))
+
+
+if __name__ == '__main__':
+    bench_client_dump()
+    bench_client_load()
+    bench_resellers_load()
+    bench_resellers_dump()
+    bench_memory()
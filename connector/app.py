@@ -1,13 +1,21 @@
+import hmac
 import logging
 import os
 import sys
 import socket
 
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify, request
 from werkzeug.contrib.fixers import ProxyFix
 
 from connector.config import Config, check_configuration
+from connector.fbclient import fallball_breaker, fallball_limiter
+from connector.fbclient.reseller import reseller_cache
+from connector.metrics import registry
+from connector.utils import ConnectorRequest, log_queue
 from connector.v1 import api_bp as api_v1
+from connector.v1.resources import (notification_managers, notifications, oa_breakers,
+                                    oa_resources, oa_schemas, oa_sessions, outbox)
+from connector.v1.resources.tenant import get_name_for_tenant, get_tenant_parser
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -19,6 +27,7 @@ stream = logging.StreamHandler(sys.stdout)
 logger.addHandler(stream)
 
 app = Flask(__name__)
+app.request_class = ConnectorRequest
 app.wsgi_app = ProxyFix(app.wsgi_app)
 
 app.register_blueprint(api_v1, url_prefix='/connector/v1')
@@ -32,6 +41,87 @@ def home():
     return jsonify({'service': 'fallball_connector', 'host': socket.gethostname()})
 
 
+def cache_stats():
+    stats = {name: cache.stats() for name, cache in (
+        ('resellers', reseller_cache),
+        ('tenant_names', get_name_for_tenant.cache),
+        ('tenant_parsers', get_tenant_parser.cache),
+        ('notification_managers', notification_managers),
+        ('oa_schemas', oa_schemas))}
+    sessions = oa_sessions.stats()
+    stats['oa_sessions'] = {'hits': sessions['hits'], 'misses': sessions['misses'],
+                            'size': sessions['sessions']}
+    resources = oa_resources.stats()
+    stats['oa_resources'] = {'hits': resources['saved'], 'misses': resources['fetched']}
+    return stats
+
+
+def breaker_stats():
+    # OA breakers are kept per controller, their URIs must not end up in label values
+    oa = list(oa_breakers.stats().values())
+    fallball = fallball_breaker.stats()
+    return {'oa': {'open': sum(stats['state'] != 'closed' for stats in oa),
+                   'rejected': sum(stats['rejected'] for stats in oa)},
+            'fallball': {'open': int(fallball['state'] != 'closed'),
+                         'rejected': fallball['rejected']}}
+
+
+def outbox_stats():
+    if outbox is None:
+        return []
+    rows = outbox.stats()
+    return [((state,), sum(row[state] or 0 for row in rows)) for state in ('pending', 'dead')]
+
+
+registry.collector('connector_cache_hits_total', 'Lookups served from a cache.', 'counter',
+                   ('cache',), lambda: [((name,), stats['hits'])
+                                        for name, stats in cache_stats().items()])
+registry.collector('connector_cache_misses_total', 'Lookups a cache could not serve.',
+                   'counter', ('cache',), lambda: [((name,), stats['misses'])
+                                                   for name, stats in cache_stats().items()])
+registry.collector('connector_cache_size', 'Entries in a cache.', 'gauge', ('cache',),
+                   lambda: [((name,), stats['size'])
+                            for name, stats in cache_stats().items() if 'size' in stats])
+registry.collector('connector_circuit_breaker_open',
+                   'Circuit breakers of an upstream suspending or trialing calls, '
+                   'OA has one per controller.', 'gauge',
+                   ('upstream',), lambda: [((upstream,), stats['open'])
+                                           for upstream, stats in breaker_stats().items()])
+registry.collector('connector_circuit_breaker_rejected_total',
+                   'Calls refused by a circuit breaker.', 'counter', ('upstream',),
+                   lambda: [((upstream,), stats['rejected'])
+                            for upstream, stats in breaker_stats().items()])
+registry.collector('connector_fallball_concurrency_limit',
+                   'Current limit on concurrent requests to FallBall.', 'gauge', (),
+                   lambda: [((), fallball_limiter.stats()['limit'])])
+registry.collector('connector_fallball_limiter_rejected_total',
+                   'Requests to FallBall refused over the concurrency limit.', 'counter', (),
+                   lambda: [((), fallball_limiter.stats()['rejected'])])
+registry.collector('connector_log_records_dropped_total',
+                   'Log records dropped because the log queue was full.', 'counter', (),
+                   lambda: [((), log_queue.dropped)])
+registry.collector('connector_jobs_dropped_total',
+                   'Background jobs dropped because the queue was full.', 'counter',
+                   ('queue',), lambda: [((notifications.name,), notifications.dropped)])
+registry.collector('connector_jobs_failed_total',
+                   'Background jobs that failed after all retries.', 'counter',
+                   ('queue',), lambda: [((notifications.name,), notifications.failed)])
+registry.collector('connector_outbox_messages', 'Messages in the outbox.', 'gauge',
+                   ('state',), outbox_stats)
+
+
+@app.route('/metrics')
+def metrics():
+    # disabled unless a token is configured, scrapers send it as a bearer token
+    token = Config().metrics_token
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(str(request.headers.get('Authorization', '')),
+                               str('Bearer {}'.format(token))):
+        abort(401)
+    return Response(registry.render_process(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     logger.info(" * Using CONFIG_FILE=%s", Config().conf_file)
 
@@ -0,0 +1,130 @@
+import functools
+import threading
+from collections import OrderedDict
+from time import time
+
+MISSING = object()
+
+
+class _Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    ``ttl=None`` keeps entries until they are evicted. ``None`` values record
+    a lookup that found nothing; they are kept for ``negative_ttl`` seconds
+    instead, or not at all when it is 0. At most ``maxsize`` entries are kept,
+    the least recently used ones are evicted first.
+    """
+
+    def __init__(self, ttl=None, negative_ttl=0, maxsize=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if expires is None or time() < expires:
+                self._entries.pop(key)
+                self._entries[key] = entry
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def get(self, key):
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl is not None and ttl <= 0:
+            return
+
+        expires = None if ttl is None else time() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while self.maxsize and len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for ``key`` or store and return ``loader()``.
+
+        Concurrent misses for the same key wait for a single ``loader()`` call
+        and share its result or exception.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not MISSING:
+                return value
+
+            flight = self._loading.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._loading[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            flight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries)}
+
+
+def memoize(ttl=None, maxsize=1024, negative_ttl=0):
+    """Cache results of a function by its positional arguments in a TTLCache."""
+    def decorator(function):
+        cache = TTLCache(ttl, negative_ttl=negative_ttl, maxsize=maxsize)
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            return cache.get_or_load(args, lambda: function(*args))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,40 @@
+# JSON encoding and decoding used across the connector. ujson is used when it
+# is installed, the standard library json module otherwise or for anything
+# ujson cannot handle.
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+backend = 'ujson' if ujson else 'json'
+
+
+def loads(data):
+    if ujson is not None:
+        try:
+            return ujson.loads(data)
+        except (ValueError, OverflowError):
+            pass  # let json report the error or parse what ujson can't
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj, **kwargs):
+    if ujson is not None and not kwargs:
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return json.dumps(obj, **kwargs)
+
+
+def response_json(response):
+    """Return the decoded body of a ``requests`` response, decoding it only once."""
+    data = getattr(response, '_connector_json', None)
+    if data is None:
+        data = loads(response.content)
+        response._connector_json = data
+    return data
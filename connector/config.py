@@ -38,6 +38,55 @@ class Config(object):
     oauth_secret = None
     environment = None
     country = None
+    oa_pool_size = None
+    oa_pool_maxsize = None
+    oa_pool_idle_timeout = None
+    fallball_pool_maxsize = None
+    fallball_api_cache_size = None
+    reseller_cache_size = None
+    reseller_cache_ttl = None
+    reseller_cache_negative_ttl = None
+    reseller_index_ttl = None
+    reseller_index_miss_ttl = None
+    tenant_cache_size = None
+    tenant_index_path = None
+    oa_schema_ttl = None
+    oa_schema_stale_ttl = None
+    notification_manager_ttl = None
+    fanout_workers = None
+    notification_workers = None
+    notification_queue_size = None
+    notification_retries = None
+    notification_retry_delay = None
+    outbox_path = None
+    outbox_batch_size = None
+    outbox_max_attempts = None
+    outbox_retry_delay = None
+    outbox_max_retry_delay = None
+    oa_backoff_base = None
+    oa_backoff_max = None
+    oa_retry_budget = None
+    oa_request_deadline = None
+    oa_breaker_threshold = None
+    oa_breaker_reset_timeout = None
+    fallball_timeout = None
+    fallball_breaker_threshold = None
+    fallball_breaker_reset_timeout = None
+    fallball_concurrency = None
+    fallball_concurrency_min = None
+    fallball_concurrency_max = None
+    fallball_slow_threshold = None
+    debug_log_sample_rate = None
+    debug_log_slow_threshold = None
+    debug_log_body_limit = None
+    debug_log_max_exchanges = None
+    server_workers = None
+    server_threads = None
+    server_timeout = None
+    server_graceful_timeout = None
+    server_max_requests = None
+    server_max_requests_jitter = None
+    metrics_token = None
 
     def __init__(self):
         if not Config.diskspace_resource:
@@ -53,6 +102,56 @@ class Config(object):
             Config.debug = bool(config.get('debug', False))
             Config.environment = config.get('parameters', {}).get('ENVIRONMENT', {})
             Config.country = config.get('parameters', {}).get('COUNTRY', {})
+            Config.oa_pool_size = int(config.get('oa_pool_size', 10))
+            Config.oa_pool_maxsize = int(config.get('oa_pool_maxsize', 10))
+            Config.oa_pool_idle_timeout = int(config.get('oa_pool_idle_timeout', 60))
+            Config.fallball_pool_maxsize = int(config.get('fallball_pool_maxsize', 10))
+            Config.fallball_api_cache_size = int(config.get('fallball_api_cache_size', 1000))
+            Config.reseller_cache_size = int(config.get('reseller_cache_size', 10000))
+            Config.reseller_cache_ttl = int(config.get('reseller_cache_ttl', 60))
+            Config.reseller_cache_negative_ttl = int(config.get('reseller_cache_negative_ttl', 5))
+            Config.reseller_index_ttl = int(config.get('reseller_index_ttl', 300))
+            Config.reseller_index_miss_ttl = int(config.get('reseller_index_miss_ttl', 10))
+            Config.tenant_cache_size = int(config.get('tenant_cache_size', 10000))
+            Config.tenant_index_path = config.get('tenant_index_path') or None
+            Config.oa_schema_ttl = int(config.get('oa_schema_ttl', 30))
+            Config.oa_schema_stale_ttl = int(config.get('oa_schema_stale_ttl', 300))
+            Config.notification_manager_ttl = int(config.get('notification_manager_ttl', 3600))
+            Config.fanout_workers = int(config.get('fanout_workers', 10))
+            Config.notification_workers = int(config.get('notification_workers', 2))
+            Config.notification_queue_size = int(config.get('notification_queue_size', 1000))
+            Config.notification_retries = int(config.get('notification_retries', 3))
+            Config.notification_retry_delay = float(config.get('notification_retry_delay', 1))
+            Config.outbox_path = config.get('outbox_path') or None
+            Config.outbox_batch_size = int(config.get('outbox_batch_size', 50))
+            Config.outbox_max_attempts = int(config.get('outbox_max_attempts', 10))
+            Config.outbox_retry_delay = float(config.get('outbox_retry_delay', 1))
+            Config.outbox_max_retry_delay = float(config.get('outbox_max_retry_delay', 300))
+            Config.oa_backoff_base = float(config.get('oa_backoff_base', 0.5))
+            Config.oa_backoff_max = float(config.get('oa_backoff_max', 10))
+            Config.oa_retry_budget = int(config.get('oa_retry_budget', 10))
+            Config.oa_request_deadline = float(config.get('oa_request_deadline', 120))
+            Config.oa_breaker_threshold = int(config.get('oa_breaker_threshold', 5))
+            Config.oa_breaker_reset_timeout = float(config.get('oa_breaker_reset_timeout', 30))
+            Config.fallball_timeout = float(config.get('fallball_timeout', 30))
+            Config.fallball_breaker_threshold = int(config.get('fallball_breaker_threshold', 5))
+            Config.fallball_breaker_reset_timeout = float(
+                config.get('fallball_breaker_reset_timeout', 30))
+            Config.fallball_concurrency = int(config.get('fallball_concurrency', 10))
+            Config.fallball_concurrency_min = int(config.get('fallball_concurrency_min', 2))
+            Config.fallball_concurrency_max = int(config.get('fallball_concurrency_max', 50))
+            Config.fallball_slow_threshold = float(config.get('fallball_slow_threshold', 5))
+            Config.debug_log_sample_rate = int(config.get('debug_log_sample_rate', 1))
+            Config.debug_log_slow_threshold = float(config.get('debug_log_slow_threshold', 5))
+            Config.debug_log_body_limit = int(config.get('debug_log_body_limit', 4096))
+            Config.debug_log_max_exchanges = int(config.get('debug_log_max_exchanges', 50))
+            Config.server_workers = int(config.get('server_workers', 0))
+            Config.server_threads = int(config.get('server_threads', 8))
+            Config.server_timeout = int(config.get('server_timeout', 180))
+            Config.server_graceful_timeout = int(config.get('server_graceful_timeout', 30))
+            Config.server_max_requests = int(config.get('server_max_requests', 10000))
+            Config.server_max_requests_jitter = int(config.get('server_max_requests_jitter', 1000))
+            Config.metrics_token = config.get('metrics_token') or None
 
             try:
                 Config.diskspace_resource = config['diskspace_resource']
@@ -0,0 +1,85 @@
+import os
+import threading
+from time import sleep
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from connector.utils import logger
+
+
+class Dispatcher(object):
+    """Runs jobs in ``workers`` background threads, callers don't wait for them.
+
+    At most ``capacity`` jobs wait in the queue, further jobs are dropped and
+    counted in ``dropped``. A failing job is retried up to ``retries`` times,
+    the first retry after ``retry_delay`` seconds and each next one after
+    twice the previous delay. Jobs that still fail are logged and counted in
+    ``failed``.
+    """
+
+    def __init__(self, name, workers=2, capacity=1000, retries=3, retry_delay=1):
+        self.name = name
+        self.workers = workers
+        self.capacity = capacity
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.dropped = 0
+        self.failed = 0
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        # worker threads do not survive a fork, start them once per process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.capacity)
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, name=self.name)
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            job, args, kwargs = self._queue.get()
+            try:
+                self._run(job, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job, args, kwargs):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                job(*args, **kwargs)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    with self._counts_lock:
+                        self.failed += 1
+                    logger.exception("%s job failed after %s attempts", self.name, attempt + 1)
+                    return
+            sleep(delay)
+            delay *= 2
+
+    def submit(self, job, *args, **kwargs):
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((job, args, kwargs))
+        except queue.Full:
+            with self._counts_lock:
+                self.dropped += 1
+            logger.error("%s queue is full, job dropped", self.name)
+
+    def join(self):
+        """Wait until every submitted job is done."""
+        if self._pid == os.getpid():
+            self._queue.join()
@@ -0,0 +1,140 @@
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from flask import _app_ctx_stack, _request_ctx_stack
+
+from connector.config import Config
+from connector.utils import request_log, task_log
+
+config = Config()
+
+
+class _Task(object):
+    __slots__ = ('call', 'log', 'result', 'error', 'run', 'claimed', 'done')
+
+    def __init__(self, call, log, run):
+        self.call = call
+        self.log = log
+        self.run = run
+        self.result = None
+        self.error = None
+        self.claimed = False
+        self.done = threading.Event()
+
+    def claim(self):
+        with _claim_lock:
+            if self.claimed:
+                return False
+            self.claimed = True
+            return True
+
+    def execute(self):
+        try:
+            self.run(self)
+        finally:
+            self.done.set()
+
+
+_claim_lock = threading.Lock()
+
+
+class Executor(object):
+    """``workers`` threads shared by all requests of the process to run fanout tasks.
+
+    A task is run by whoever claims it first, a worker or the caller waiting
+    for it, so calls never wait for a busy pool and nested ``parallel`` calls
+    can not deadlock it.
+    """
+
+    def __init__(self, workers=10):
+        self.workers = workers
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        # worker threads do not survive a fork, start them once per process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, name='fanout')
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task.claim():
+                task.execute()
+
+    def submit(self, task):
+        self._ensure_workers()
+        self._queue.put(task)
+
+
+executor = Executor(config.fanout_workers)
+
+
+def parallel(*calls):
+    """Run independent calls concurrently and return their results in order.
+
+    Calls run on the shared ``executor``, the caller runs those no worker has
+    picked up. Every call gets the app and request context of the caller, so
+    it may use ``g`` and ``request`` like code running in the request itself;
+    what they keep in ``g`` must be safe to share between threads. Outgoing
+    requests are added to the request log in the order of ``calls`` rather
+    than the order they completed. All calls run to completion, then the
+    exception of the first failed call, if any, is raised.
+    """
+    if len(calls) < 2:
+        return [call() for call in calls]
+
+    log = request_log()
+    app_ctx = _app_ctx_stack.top
+    request_ctx = _request_ctx_stack.top
+
+    def run(task):
+        parent_log = getattr(task_log, 'log', None)
+        if app_ctx is not None:
+            _app_ctx_stack.push(app_ctx)
+        if request_ctx is not None:
+            _request_ctx_stack.push(request_ctx)
+        task_log.log = task.log
+        try:
+            task.result = task.call()
+        except Exception as e:
+            task.error = e
+        finally:
+            task_log.log = parent_log
+            if request_ctx is not None:
+                _request_ctx_stack.pop()
+            if app_ctx is not None:
+                _app_ctx_stack.pop()
+
+    tasks = [_Task(call, log.child() if log else None, run) for call in calls]
+    for task in tasks[1:]:
+        executor.submit(task)
+    for task in tasks:
+        if task.claim():
+            task.execute()
+    for task in tasks:
+        task.done.wait()
+
+    if log:
+        for task in tasks:
+            log.merge(task.log)
+
+    for task in tasks:
+        if task.error is not None:
+            raise task.error
+    return [task.result for task in tasks]
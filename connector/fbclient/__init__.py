@@ -1,18 +1,50 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import slumber
-from slumber import exceptions
+from slumber import exceptions, serialize
 from marshmallow import Schema, fields
 
-from requests import Request
+from requests import Request, Session
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
 
-from flask import g
-
+from connector import codec
 from connector.config import Config
-from connector.utils import log_outgoing_request, log_outgoing_response
+from connector.pool import BlockCookies
+from connector.resilience import AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+from connector.utils import UpstreamCall, request_log
 
 config = Config()
 
 
+class SchemaCache(threading.local):
+    # marshmallow schemas keep state while dumping or loading, so instances
+    # are reused within a thread but never shared between threads
+    def __init__(self):
+        self.instances = {}
+
+    def get(self, schema_class):
+        instance = self.instances.get(schema_class)
+        if instance is None:
+            instance = self.instances[schema_class] = schema_class()
+        return instance
+
+
+schemas = SchemaCache()
+
+
+def dump_fields(schema, obj):
+    # models use __slots__, so collect the set attributes the schema knows about
+    data = {}
+    for name in schema.fields:
+        value = getattr(obj, name, None)
+        if value:
+            data[name] = value
+    return data
+
+
 class StorageSchema(Schema):
     usage = fields.Int(load_only=True)
     limit = fields.Int()
@@ -27,6 +59,64 @@ class FallBallAuth(AuthBase):
         return r
 
 
+class JsonSerializer(serialize.JsonSerializer):
+    def loads(self, data):
+        return codec.loads(data)
+
+    def dumps(self, data):
+        return codec.dumps(data)
+
+
+fallball_breaker = CircuitBreaker(config.fallball_breaker_threshold,
+                                  config.fallball_breaker_reset_timeout)
+fallball_limiter = AdaptiveLimiter(initial=config.fallball_concurrency,
+                                   minimum=config.fallball_concurrency_min,
+                                   maximum=config.fallball_concurrency_max,
+                                   slow_threshold=config.fallball_slow_threshold)
+_background = threading.local()
+
+
+@contextmanager
+def background_calls():
+    """FallBall calls made inside are not waited on by clients, so their slowness
+    does not lower the concurrency limit."""
+    previous = getattr(_background, 'active', False)
+    _background.active = True
+    try:
+        yield
+    finally:
+        _background.active = previous
+
+
+def send_guarded(session, prepped):
+    # fail fast instead of piling up threads on a FallBall that is down or overloaded
+    if not fallball_limiter.acquire():
+        raise UpstreamUnavailable('Too many concurrent requests to FallBall')
+    if not fallball_breaker.allow():
+        fallball_limiter.release()
+        raise UpstreamUnavailable('FallBall is unavailable',
+                                  retry_after=fallball_breaker.retry_after())
+
+    call = UpstreamCall('fallball', prepped.method)
+    try:
+        resp = session.send(prepped, timeout=config.fallball_timeout)
+        call.status = resp.status_code
+    except Exception:
+        fallball_breaker.failure()
+        fallball_limiter.release(False)
+        raise
+    finally:
+        duration = call.done()
+
+    success = resp.status_code < 500
+    if success:
+        fallball_breaker.success()
+    else:
+        fallball_breaker.failure()
+    fallball_limiter.release(success, None if getattr(_background, 'active', False) else duration)
+    return resp
+
+
 class LoggingResource(slumber.Resource):
     def _request(self, method, data=None, files=None, params=None):
         serializer = self._store["serializer"]
@@ -43,10 +133,11 @@ class LoggingResource(slumber.Resource):
                       headers=headers)
         s = self._store["session"]
         prepped = s.prepare_request(req)
-        g.log['out'].append(dict(request=None, response=None))
-        g.log['out'][-1]['request'] = log_outgoing_request(prepped)
-        resp = s.send(prepped)
-        g.log['out'][-1]['response'] = log_outgoing_response(resp)
+        log = request_log()
+        exchange = log.outgoing(prepped) if log else None
+        resp = send_guarded(s, prepped)
+        if exchange:
+            exchange.done(resp)
 
         if 400 <= resp.status_code <= 499:
             exception_class = exceptions.HttpNotFoundError if resp.status_code == 404 \
@@ -60,6 +151,61 @@ class LoggingResource(slumber.Resource):
         self._ = resp
         return resp
 
+    def _try_to_serialize_response(self, resp):
+        content_type = resp.headers.get('content-type', '').split(';')[0].strip()
+        if resp.status_code not in (204, 205) and resp.content \
+                and content_type in JsonSerializer.content_types:
+            try:
+                return codec.response_json(resp)
+            except ValueError:
+                return resp.content
+        return super(LoggingResource, self)._try_to_serialize_response(resp)
+
 
 class LoggingApi(slumber.API):
     resource_class = LoggingResource
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('serializer', serialize.Serializer(default='json',
+                                                             serializers=[JsonSerializer()]))
+        super(LoggingApi, self).__init__(*args, **kwargs)
+
+
+class ApiCache(object):
+    """Ready-made API roots per token, all sharing one pooled connection adapter."""
+
+    def __init__(self, url, maxsize=10, size=1000):
+        self.url = url
+        self.size = size
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._apis = OrderedDict()
+
+    def _make_api(self, token):
+        session = Session()
+        # sessions are shared by all requests with the token, they must not carry cookies
+        session.cookies.set_policy(BlockCookies())
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return LoggingApi(self.url, auth=FallBallAuth(token), session=session)
+
+    def get(self, token):
+        with self._lock:
+            api = self._apis.pop(token, None)
+            if api is None:
+                api = self._make_api(token)
+            self._apis[token] = api
+
+            while len(self._apis) > self.size:
+                self._apis.popitem(last=False)
+
+        return api
+
+    def clear(self):
+        with self._lock:
+            self._apis.clear()
+        self.adapter.close()
+
+
+fallball_apis = ApiCache(config.fallball_service_url, maxsize=config.fallball_pool_maxsize,
+                         size=config.fallball_api_cache_size)
@@ -1,6 +1,6 @@
 from marshmallow import Schema, fields, post_load, pre_dump
 
-from connector.fbclient import StorageSchema
+from connector.fbclient import StorageSchema, dump_fields, schemas
 
 
 class ClientSchema(Schema):
@@ -20,19 +20,12 @@ class ClientSchema(Schema):
 
     @pre_dump
     def dump_client(self, data):
-        return {k: v for k, v in data.__dict__.items() if v}
+        return dump_fields(self, data)
 
 
 class Client(object):
-    name = None
-    email = None
-    users_amount = None
-    is_integrated = True
-    storage = None
-    reseller = None
-    users_by_type = None
-    country = None
-    environment = None
+    __slots__ = ('reseller', 'name', 'email', 'is_integrated', 'users_amount', 'storage',
+                 'users_by_type', 'postal_code', 'country', 'environment')
 
     def __init__(self, reseller=None, name=None, email=None, is_integrated=True, users_amount=None,
                  storage=None, users_by_type=None, postal_code=None, country=None,
@@ -56,7 +49,7 @@ class Client(object):
 
     @property
     def _dump(self):
-        return ClientSchema().dump(self).data
+        return schemas.get(ClientSchema).dump(self).data
 
     def create(self):
         api = self.api()
@@ -71,7 +64,7 @@ class Client(object):
     def refresh(self):
         api = self.api()
         result = api.clients(self.name).get()
-        c = ClientSchema().load(result).data
+        c = schemas.get(ClientSchema).load(result).data
         self.__init__(self.reseller, name=c.name, email=c.email, is_integrated=c.is_integrated,
                       users_amount=c.users_amount, storage=c.storage, users_by_type=c.users_by_type,
                       country=c.country, environment=c.environment)
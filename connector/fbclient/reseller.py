@@ -2,10 +2,12 @@ from marshmallow import Schema, fields, post_load, pre_dump
 
 from slumber.exceptions import HttpNotFoundError
 
-from connector.fbclient import FallBallAuth, StorageSchema
-from connector.fbclient import config
+from connector.cache import MISSING, TTLCache
+from connector.fbclient import StorageSchema, dump_fields, schemas
+from connector.fbclient import config, fallball_apis
 
-from . import LoggingApi
+reseller_cache = TTLCache(config.reseller_cache_ttl, config.reseller_cache_negative_ttl,
+                          maxsize=config.reseller_cache_size)
 
 
 class ResellerSchema(Schema):
@@ -21,15 +23,11 @@ class ResellerSchema(Schema):
 
     @pre_dump
     def dump_reseller(self, data):
-        return {k: v for k, v in data.__dict__.items() if v}
+        return dump_fields(self, data)
 
 
 class Reseller(object):
-    name = None
-    rid = None
-    token = None
-    _clients_amount = None
-    storage = None
+    __slots__ = ('name', 'rid', 'token', '_clients_amount', 'storage')
 
     def __init__(self, name, rid=None, token=None, clients_amount=None, storage=None):
         self.name = name
@@ -44,41 +42,63 @@ class Reseller(object):
 
     def api(self, token=None):
         token = token if token else self.token
-        return LoggingApi(config.fallball_service_url, auth=FallBallAuth(token))
+        return fallball_apis.get(token)
 
     def __repr__(self):
         return '<Reseller(name={})>'.format(self.name)
 
     @property
     def _dump(self):
-        return ResellerSchema().dump(self).data
+        return schemas.get(ResellerSchema).dump(self).data
+
+    def copy(self):
+        storage = dict(self.storage) if self.storage else self.storage
+        return Reseller(name=self.name, rid=self.rid, token=self.token,
+                        clients_amount=self.clients_amount, storage=storage)
 
     def create(self):
         api = self.api(config.fallball_service_authorization_token)
         if not self.storage:
             self.storage = {'limit': 1000000}
         result = api.resellers.post(self._dump)
+        reseller_cache.invalidate(self.name)
         return result
 
     def refresh(self):
-        api = self.api(config.fallball_service_authorization_token)
-        try:
-            result = api.resellers(self.name).get()
-            r = ResellerSchema().load(result).data
+        r = Reseller.fetch(self.name)
+        if r:
             self.__init__(name=r.name, rid=r.rid, token=r.token, clients_amount=r.clients_amount,
                           storage=r.storage)
-        except HttpNotFoundError:
-            pass
 
     def delete(self):
         api = self.api(config.fallball_service_authorization_token)
         result = api.resellers(self.name).delete()
+        reseller_cache.invalidate(self.name)
         return result
 
+    @staticmethod
+    def fetch(name):
+        api = fallball_apis.get(config.fallball_service_authorization_token)
+        try:
+            result = api.resellers(name).get()
+        except HttpNotFoundError:
+            return None
+        return schemas.get(ResellerSchema).load(result).data
+
+    @staticmethod
+    def get(name, rid=None):
+        found = reseller_cache.get(name)
+        if found is MISSING:
+            found = Reseller.fetch(name)
+            reseller_cache.set(name, found)
+
+        if found is None:
+            return Reseller(name, rid)
+        return found.copy()
+
     @staticmethod
     def all():
-        api = LoggingApi(config.fallball_service_url,
-                         auth=FallBallAuth(config.fallball_service_authorization_token))
+        api = fallball_apis.get(config.fallball_service_authorization_token)
         result = api.resellers.get()
-        resellers = ResellerSchema().load(result, many=True).data
+        resellers = schemas.get(ResellerSchema).load(result, many=True).data
         return resellers
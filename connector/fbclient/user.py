@@ -1,6 +1,6 @@
 from marshmallow import Schema, fields, post_load, pre_dump
 
-from connector.fbclient import StorageSchema
+from connector.fbclient import StorageSchema, dump_fields, schemas
 
 
 class UserSchema(Schema):
@@ -18,16 +18,12 @@ class UserSchema(Schema):
 
     @pre_dump
     def dump_user(self, data):
-        return {k: v for k, v in data.__dict__.items() if v}
+        return dump_fields(self, data)
 
 
 class User(object):
-    user_id = None
-    email = None
-    password = None
-    admin = None
-    storage = None
-    profile_type = None
+    __slots__ = ('client', 'user_id', 'email', 'password', 'admin', 'superadmin', 'storage',
+                 'profile_type')
 
     def __init__(self, client=None, user_id=None, email=None, password=None, admin=None,
                  superadmin=None, storage=None, profile_type=None):
@@ -48,7 +44,7 @@ class User(object):
 
     @property
     def _dump(self):
-        return UserSchema().dump(self).data
+        return schemas.get(UserSchema).dump(self).data
 
     def create(self):
         api = self.api()
@@ -67,7 +63,7 @@ class User(object):
     def refresh(self):
         api = self.api()
         result = api.users(self.user_id).get()
-        u = UserSchema().load(result).data
+        u = schemas.get(UserSchema).load(result).data
         self.__init__(self.client, user_id=u.user_id, email=u.email, password=u.password,
                       admin=u.admin, superadmin=u.superadmin, storage=u.storage,
                       profile_type=u.profile_type)
@@ -0,0 +1,203 @@
+"""Process-wide metrics, rendered in the Prometheus text format on ``/metrics``.
+
+Every worker process keeps its own values, so samples carry a ``pid`` label:
+a scrape answered by one worker never looks like a reset of another one's
+counters. Sum over ``pid`` to get totals of the host.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _label_values(labels):
+    # 200 and '200' are the same series, and series sort the same on py2 and py3
+    return tuple(str(label) for label in labels)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+class Metric(object):
+    """A metric family; values are kept per tuple of label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        """Yield ``(suffix, label names, label values, value)`` of every sample."""
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield '', self.labels, label_values, value
+
+    def render(self, labels=()):
+        """Render the family; ``labels`` are ``(name, value)`` pairs added to every sample."""
+        const_names = tuple(name for name, _ in labels)
+        const_values = tuple(str(value) for _, value in labels)
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, names, values, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix,
+                                            _format_labels(const_names + names,
+                                                           const_values + values),
+                                            _format_value(value)))
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        labels = _label_values(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(_label_values(labels), 0)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+    def set(self, value, *labels):
+        labels = _label_values(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Counts observations in buckets of upper bounds ``buckets``, plus their sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        labels = _label_values(labels)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        names = self.labels + ('le',)
+        with self._lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self._values.items()]
+        for label_values, counts, total in sorted(values):
+            count = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                count += bucket_count
+                yield '_bucket', names, label_values + (_format_value(float(bound)),), count
+            yield '_sum', self.labels, label_values, total
+            yield '_count', self.labels, label_values, count
+
+
+class Collector(Metric):
+    """A metric read at render time from ``collect()``, which returns
+    ``(label values, value)`` pairs; for counts kept elsewhere, e.g. cache stats.
+    """
+
+    def __init__(self, name, help, kind, labels, collect):
+        super(Collector, self).__init__(name, help, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        samples = [(_label_values(labels), value) for labels, value in self.collect()]
+        for label_values, value in sorted(samples):
+            yield '', self.labels, label_values, value
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def collector(self, name, help, kind, labels, collect):
+        return self.add(Collector(name, help, kind, labels, collect))
+
+    def render(self, labels=()):
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render(labels) for metric in metrics) + '\n'
+
+    def render_process(self):
+        """Render with the ``pid`` label of this worker process."""
+        return self.render((('pid', os.getpid()),))
+
+    def clear(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+requests_in_flight = registry.gauge('connector_requests_in_flight',
+                                    'Requests being handled.')
+request_duration = registry.histogram('connector_request_duration_seconds',
+                                      'Time to handle a request, by endpoint.',
+                                      ('endpoint', 'method', 'status'))
+upstream_in_flight = registry.gauge('connector_upstream_requests_in_flight',
+                                    'Requests to OA and FallBall waiting for a response.',
+                                    ('target',))
+upstream_duration = registry.histogram('connector_upstream_request_duration_seconds',
+                                       'Time of a request to OA or FallBall.',
+                                       ('target', 'method', 'status'))
+upstream_retries = registry.counter('connector_upstream_retries_total',
+                                    'Requests to OA or FallBall sent again after a failure.',
+                                    ('target',))
@@ -0,0 +1,256 @@
+"""Durable queue of OA requests that may be delivered after the response.
+
+Inspect or drain the outbox configured by ``outbox_path``:
+
+    python -m connector.outbox stats|list|drain|retry|purge
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from time import time
+
+from connector import codec
+from connector.utils import logger
+
+
+class Outbox(object):
+    """Messages kept in an SQLite file until ``deliver(controller, message)`` succeeds.
+
+    A background thread delivers messages in batches. A message put with a
+    ``key`` replaces the pending message of its controller with the same key,
+    and waits while an earlier one with that key is being delivered; other
+    messages do not wait for each other, so a failing message holds back no
+    other. Failed messages are retried after ``retry_delay`` seconds, doubled
+    on every attempt up to ``max_retry_delay``. After ``max_attempts`` they
+    are marked dead and kept for inspection. Several processes may share the
+    file, a message is leased to one of them while it is delivered; ``lease``
+    must be longer than one delivery may take. A claimed batch is leased once
+    and every message's lease is renewed right before it is delivered. ``put`` waits at most
+    ``put_timeout`` seconds for the file and returns False if it can not
+    store the message, callers then send it themselves.
+    """
+
+    def __init__(self, path, deliver, batch_size=50, max_attempts=10, retry_delay=1,
+                 max_retry_delay=300, lease=300, poll_interval=1, put_timeout=1):
+        self.path = path
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.put_timeout = put_timeout
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _connection(self):
+        # connections must not be shared between threads or forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS messages ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'controller TEXT NOT NULL, '
+                               'message TEXT NOT NULL, '
+                               'created REAL NOT NULL, '
+                               'attempts INTEGER NOT NULL DEFAULT 0, '
+                               'next_attempt REAL NOT NULL DEFAULT 0, '
+                               'locked_until REAL NOT NULL DEFAULT 0, '
+                               'dead INTEGER NOT NULL DEFAULT 0, '
+                               'last_error TEXT, '
+                               'key TEXT)')
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(messages)')]
+            if 'key' not in columns:
+                connection.execute('ALTER TABLE messages ADD COLUMN key TEXT')
+            connection.execute('CREATE INDEX IF NOT EXISTS messages_key '
+                               'ON messages (controller, key, dead, id)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def start(self):
+        # the delivery thread does not survive a fork, start one per process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._work, name='outbox')
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def put(self, controller, message, key=None):
+        """Store a message, False if the outbox can not be written right now."""
+        now = time()
+        try:
+            connection = self._connection()
+            # callers wait for this, do not stall them behind a long write of another process
+            connection.execute('PRAGMA busy_timeout = {}'.format(int(self.put_timeout * 1000)))
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if key is not None:
+                    connection.execute('DELETE FROM messages WHERE controller = ? AND key = ? '
+                                       'AND locked_until <= ?', (controller, key, now))
+                connection.execute('INSERT INTO messages (controller, message, created, key) '
+                                   'VALUES (?, ?, ?, ?)',
+                                   (controller, codec.dumps(message), now, key))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            logger.exception("Failed to write outbox %s", self.path)
+            return False
+        self.start()
+        self._wakeup.set()
+        return True
+
+    def _claim(self, force=False):
+        now = time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT id, controller, message, attempts FROM messages AS m '
+                'WHERE dead = 0 AND locked_until <= ? AND (? OR next_attempt <= ?) '
+                'AND (key IS NULL OR id = (SELECT MIN(id) FROM messages '
+                '                          WHERE controller = m.controller AND key = m.key '
+                '                          AND dead = 0)) '
+                'ORDER BY id LIMIT ?',
+                (now, int(force), now, self.batch_size)).fetchall()
+            locked_until = now + self.lease
+            connection.executemany('UPDATE messages SET locked_until = ? WHERE id = ?',
+                                   [(locked_until, row[0]) for row in rows])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [tuple(row) + (locked_until,) for row in rows]
+
+    def _renew(self, message_id, locked_until):
+        # messages of a batch are delivered one after another, each one gets a fresh lease
+        # right before its delivery, unless another process took it over meanwhile
+        return self._connection().execute(
+            'UPDATE messages SET locked_until = ? WHERE id = ? AND locked_until = ?',
+            (time() + self.lease, message_id, locked_until)).rowcount == 1
+
+    def _failed(self, message_id, attempts, error):
+        attempts += 1
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        self._connection().execute(
+            'UPDATE messages SET attempts = ?, next_attempt = ?, locked_until = 0, dead = ?, '
+            'last_error = ? WHERE id = ?',
+            (attempts, time() + delay, int(attempts >= self.max_attempts), error, message_id))
+
+    def deliver_batch(self, force=False):
+        """Deliver one batch of messages, return the number of delivered and failed ones.
+
+        ``force`` ignores the retry delay of failed messages.
+        """
+        delivered = failed = 0
+        for message_id, controller, message, attempts, locked_until in self._claim(force):
+            if not self._renew(message_id, locked_until):
+                continue
+            try:
+                self.deliver(controller, codec.loads(message))
+            except Exception as e:
+                logger.exception("Failed to deliver outbox message %s to %s",
+                                 message_id, controller)
+                self._failed(message_id, attempts, str(e))
+                failed += 1
+            else:
+                self._connection().execute('DELETE FROM messages WHERE id = ?', (message_id,))
+                delivered += 1
+        return delivered, failed
+
+    def _work(self):
+        while True:
+            try:
+                delivered, _ = self.deliver_batch()
+            except sqlite3.Error:
+                logger.exception("Failed to read outbox %s", self.path)
+                delivered = 0
+            if not delivered:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def drain(self):
+        """Deliver messages until none is left or every remaining one fails."""
+        total = 0
+        while True:
+            delivered, failed = self.deliver_batch(force=True)
+            total += delivered
+            if not delivered:
+                return total
+
+    def stats(self):
+        rows = self._connection().execute(
+            'SELECT controller, SUM(1 - dead), SUM(dead), MIN(created) FROM messages '
+            'GROUP BY controller').fetchall()
+        return [{'controller': controller, 'pending': pending, 'dead': dead, 'oldest': oldest}
+                for controller, pending, dead, oldest in rows]
+
+    def list(self, limit=100):
+        rows = self._connection().execute(
+            'SELECT id, controller, message, created, attempts, dead, last_error FROM messages '
+            'ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [{'id': row[0], 'controller': row[1], 'message': codec.loads(row[2]),
+                 'created': row[3], 'attempts': row[4], 'dead': bool(row[5]),
+                 'last_error': row[6]} for row in rows]
+
+    def retry(self):
+        """Make dead and delayed messages due again, return their number."""
+        return self._connection().execute(
+            'UPDATE messages SET dead = 0, attempts = 0, next_attempt = 0, locked_until = 0 '
+            'WHERE dead = 1 OR next_attempt > ?', (time(),)).rowcount
+
+    def purge(self, dead_only=True):
+        query = 'DELETE FROM messages'
+        if dead_only:
+            query += ' WHERE dead = 1'
+        return self._connection().execute(query).rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m connector.outbox',
+                                     description='Inspect or drain the OA outbox.')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('stats', help='show pending and dead messages per controller')
+    list_parser = commands.add_parser('list', help='show queued messages')
+    list_parser.add_argument('--limit', type=int, default=100)
+    commands.add_parser('drain', help='deliver all messages now')
+    commands.add_parser('retry', help='make dead and delayed messages due again')
+    purge_parser = commands.add_parser('purge', help='delete dead messages')
+    purge_parser.add_argument('--all', action='store_true', help='delete every message')
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error('a command is required')
+
+    from connector.v1.resources import outbox
+    if outbox is None:
+        sys.stderr.write('outbox_path is not set in the config file\n')
+        return 1
+
+    if args.command == 'stats':
+        result = outbox.stats()
+    elif args.command == 'list':
+        result = outbox.list(args.limit)
+    elif args.command == 'drain':
+        result = {'delivered': outbox.drain()}
+    elif args.command == 'retry':
+        result = {'retried': outbox.retry()}
+    else:
+        result = {'purged': outbox.purge(dead_only=not args.all)}
+    sys.stdout.write(codec.dumps(result, indent=4) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+try:
+    from http.cookiejar import DefaultCookiePolicy
+except ImportError:
+    from cookielib import DefaultCookiePolicy
+
+
+class BlockCookies(DefaultCookiePolicy):
+    """Cookie policy of sessions shared by requests of different clients."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class SessionPool(object):
+    """Process-wide keep-alive sessions, one per upstream base URI.
+
+    ``size`` limits how many upstreams are kept at once (least recently used
+    ones are closed first), ``maxsize`` limits connections kept per host and
+    sessions not used for ``idle_timeout`` seconds are re-created.
+    """
+
+    def __init__(self, size=10, maxsize=10, idle_timeout=60):
+        self.size = size
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _make_session(self):
+        session = Session()
+        # the session serves every reseller and tenant, it must not carry cookies
+        session.cookies.set_policy(BlockCookies())
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _acquire(self, key):
+        now = time()
+        retired = []
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry and entry['busy'] == 0 and self.idle_timeout \
+                    and now - entry['used'] > self.idle_timeout:
+                retired.append(entry['session'])
+                entry = None
+
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+                entry = {'session': self._make_session(), 'busy': 0, 'used': now}
+
+            entry['busy'] += 1
+            entry['used'] = now
+            self._entries[key] = entry
+
+            for other_key in list(self._entries):
+                if len(self._entries) <= self.size:
+                    break
+                if self._entries[other_key]['busy'] == 0:
+                    retired.append(self._entries.pop(other_key)['session'])
+
+        for session in retired:
+            session.close()
+
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry['busy'] -= 1
+            entry['used'] = time()
+
+    @contextmanager
+    def session(self, key):
+        entry = self._acquire(key)
+        try:
+            yield entry['session']
+        finally:
+            self._release(entry)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+
+        for entry in entries:
+            entry['session'].close()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'sessions': len(self._entries)}
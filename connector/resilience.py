@@ -0,0 +1,196 @@
+import random
+import threading
+from time import time
+
+from flask import g, has_app_context
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter, capped at ``cap`` seconds."""
+
+    def __init__(self, base=0.5, cap=10):
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class RetryBudget(object):
+    """Retries and time left for all outbound calls made while serving one request.
+
+    ``retries`` limits the retries of all calls together and ``deadline``
+    the seconds spent on them, counted from the first call.
+    """
+
+    _current_lock = threading.Lock()
+
+    def __init__(self, retries=10, deadline=120):
+        self.retries = retries
+        self.expires = time() + deadline
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires - time()
+
+    def spend(self, delay):
+        """Take one retry that starts after ``delay`` seconds, False if none is left."""
+        with self._lock:
+            if self.retries <= 0 or self.remaining() <= delay:
+                return False
+            self.retries -= 1
+            return True
+
+    @staticmethod
+    def current(retries, deadline):
+        # one budget per request, calls outside of a request get their own
+        if not has_app_context():
+            return RetryBudget(retries, deadline)
+        # fanout threads of the request share g
+        with RetryBudget._current_lock:
+            budget = getattr(g, 'retry_budget', None)
+            if budget is None:
+                budget = g.retry_budget = RetryBudget(retries, deadline)
+            return budget
+
+
+class CircuitBreaker(object):
+    """Stops calls to an upstream after ``threshold`` failures in a row.
+
+    While open, calls fail fast. After ``reset_timeout`` seconds one trial
+    call is let through, its success closes the breaker and its failure
+    opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # a trial call that never reported back is replaced after reset_timeout
+            if time() - self.opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened = time()
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened = time()
+
+    def retry_after(self):
+        """Seconds until the next trial call, 0 when calls are allowed."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            return max(0, self.reset_timeout - (time() - self.opened))
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state,
+                    'failures': self.failures,
+                    'rejected': self.rejected}
+
+
+class AdaptiveLimiter(object):
+    """Limits concurrent calls to an upstream, adapting the limit to how it copes (AIMD).
+
+    Every successful call raises the limit by ``1 / limit``, about one per
+    round of calls, up to ``maximum``. A failed call, or one slower than
+    ``slow_threshold`` seconds, multiplies it by ``backoff``, down to
+    ``minimum``. Calls over the limit are rejected right away.
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=100, backoff=0.5, slow_threshold=None):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.slow_threshold = slow_threshold
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, success=None, duration=None):
+        """End a call; ``success=None`` leaves the limit as it is."""
+        with self._lock:
+            self.in_flight -= 1
+            if success is None:
+                return
+            if success and (self.slow_threshold is None or duration is None or
+                            duration <= self.slow_threshold):
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+
+    def stats(self):
+        with self._lock:
+            return {'limit': int(self.limit),
+                    'in_flight': self.in_flight,
+                    'rejected': self.rejected}
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was refused locally, clients should retry after ``retry_after`` seconds."""
+
+    code = 503
+
+    def __init__(self, message, retry_after=1):
+        super(UpstreamUnavailable, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreakers(object):
+    """Circuit breakers by upstream, created on first use."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.threshold,
+                                                               self.reset_timeout)
+            return breaker
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
+
+    def stats(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {key: breaker.stats() for key, breaker in breakers}
@@ -0,0 +1,79 @@
+"""Production server: pre-forked gunicorn workers with threads serving ``connector.app``.
+
+    python -m connector.server
+
+The app is loaded and its caches are warmed once in the master process before
+workers are forked. ``kill -HUP`` on the master starts new workers and stops
+the old ones gracefully; workers are also replaced after ``server_max_requests``
+requests. ``CONNECTOR_PORT``, ``CONNECTOR_WORKERS`` and ``CONNECTOR_THREADS``
+override the port and the ``server_*`` settings of ``config.yml``.
+"""
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from connector.config import Config, check_configuration
+
+
+def server_options(config, environ=os.environ):
+    workers = int(environ.get('CONNECTOR_WORKERS', config.server_workers))
+    return {
+        'bind': '0.0.0.0:{}'.format(environ.get('CONNECTOR_PORT', '5000')),
+        'workers': workers or multiprocessing.cpu_count(),
+        'worker_class': 'gthread',
+        'threads': int(environ.get('CONNECTOR_THREADS', config.server_threads)),
+        'timeout': config.server_timeout,
+        'graceful_timeout': config.server_graceful_timeout,
+        'max_requests': config.server_max_requests,
+        'max_requests_jitter': config.server_max_requests_jitter,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }
+
+
+def warm_up():
+    from connector.v1.resources.application import reseller_index
+
+    reseller_index.warm()
+
+
+def post_fork(server, worker):
+    # connections opened by the master while warming up must not be shared by workers
+    from connector.fbclient import fallball_apis
+    from connector.metrics import registry
+    from connector.v1.resources import oa_sessions
+
+    oa_sessions.clear()
+    fallball_apis.clear()
+    registry.clear()
+
+
+class ConnectorServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super(ConnectorServer, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from connector.app import app
+
+        warm_up()
+        return app
+
+
+def main():
+    config = Config()
+    if not check_configuration(config):
+        raise RuntimeError("You can't run your connector with default "
+                           "parameters, please update the YML config "
+                           "file and replace PUT_HERE_* values with real "
+                           "ones")
+    ConnectorServer(server_options(config)).run()
+
+
+if __name__ == '__main__':
+    main()
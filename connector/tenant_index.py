@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+
+from connector.utils import logger
+
+
+class TenantIndex(object):
+    """Tenant id to company name map kept in an SQLite file.
+
+    The database runs in WAL mode so every worker process on the host can read
+    it while another one writes, and entries survive restarts. Storage errors
+    are logged and treated as misses, the index is only an optimization.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # connections must not be shared between threads or forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS tenants '
+                               '(tenant_id TEXT PRIMARY KEY, name TEXT NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, tenant_id):
+        try:
+            row = self._connection().execute('SELECT name FROM tenants WHERE tenant_id = ?',
+                                             (str(tenant_id),)).fetchone()
+        except sqlite3.Error:
+            logger.exception("Failed to read tenant index %s", self.path)
+            return None
+        return row[0] if row else None
+
+    def set(self, tenant_id, name):
+        try:
+            self._connection().execute('INSERT OR REPLACE INTO tenants (tenant_id, name) '
+                                       'VALUES (?, ?)', (str(tenant_id), name))
+        except sqlite3.Error:
+            logger.exception("Failed to update tenant index %s", self.path)
+
+    def delete(self, tenant_id):
+        try:
+            self._connection().execute('DELETE FROM tenants WHERE tenant_id = ?',
+                                       (str(tenant_id),))
+        except sqlite3.Error:
+            logger.exception("Failed to update tenant index %s", self.path)
@@ -1,30 +1,51 @@
 import logging
 import datetime
+import itertools
 import sys
-import json
 import os
 import re
+import threading
 import uuid
 
-from flask import g
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
+try:
+    from time import monotonic as clock
+except ImportError:  # python 2
+    from time import time as clock
+
+from flask import Request, g, has_app_context
+
+from connector import codec
+from connector.config import Config
+from connector.metrics import upstream_duration, upstream_in_flight
+
+config = Config()
 logger = logging.getLogger(__file__)
 
 
 class ResellerNameFilter(logging.Filter):
     def filter(self, record):
-        record.reseller_name = str(getattr(g, 'reseller_name', None))
+        reseller_name = getattr(g, 'reseller_name', None) if has_app_context() else None
+        record.reseller_name = str(reseller_name)
         return True
 
 
 class ConnectorLogFormatter(logging.Formatter):
+    def __init__(self, indent=None):
+        super(ConnectorLogFormatter, self).__init__()
+        self.indent = indent
+
     def format(self, record):
         resp = {}
         if isinstance(record.msg, dict):
             resp['message'] = record.msg
         else:
             resp['message'] = record.getMessage()
-        resp['time'] = datetime.datetime.now().isoformat(' ')
+        resp['time'] = datetime.datetime.fromtimestamp(record.created).isoformat(' ')
         resp['level'] = record.levelname
         resp['reseller_id'] = record.reseller_name
 
@@ -32,16 +53,21 @@ class ConnectorLogFormatter(logging.Formatter):
             rec_type = record.msg.pop('type', None)
             if 'data' in record.msg:
                 try:
-                    record.msg['data'] = json.loads(record.msg['data'])
+                    record.msg['data'] = codec.loads(record.msg['data'])
                 except:
                     pass
         else:
             rec_type = None
 
         if rec_type:
-            return '{}: {}'.format(rec_type.upper(), json.dumps(resp, indent=4))
+            return '{}: {}'.format(rec_type.upper(), self._dumps(resp))
+
+        return self._dumps(resp)
 
-        return json.dumps(resp, indent=4)
+    def _dumps(self, resp):
+        if self.indent:
+            return codec.dumps(resp, indent=self.indent)
+        return codec.dumps(resp)
 
 
 class JsonLogFormatter(logging.Formatter):
@@ -51,45 +77,126 @@ class JsonLogFormatter(logging.Formatter):
             resp['message'] = record.msg
         else:
             resp['message'] = record.getMessage()
-        resp['time'] = datetime.datetime.now().isoformat(' ')
+        resp['time'] = datetime.datetime.fromtimestamp(record.created).isoformat(' ')
         resp['level'] = record.levelname
         resp['reseller_id'] = record.reseller_name
-        return json.dumps(resp)
+        return codec.dumps(resp)
+
+
+class QueueLogHandler(logging.Handler):
+    """Passes records to a background thread that formats them and writes them to ``target``.
+
+    At most ``capacity`` records wait in the queue, further records are
+    dropped and counted in ``dropped`` so a slow output never blocks requests.
+    """
+
+    def __init__(self, target, capacity=10000):
+        super(QueueLogHandler, self).__init__()
+        self.target = target
+        self.capacity = capacity
+        self.dropped = 0
+        self.queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._dropped_lock = threading.Lock()
+
+    def _ensure_writer(self):
+        # the writer thread does not survive a fork, start one per process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.capacity)
+            self._thread = threading.Thread(target=self._write, name='log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def emit(self, record):
+        self._ensure_writer()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+            except queue.Full:
+                pass
+            self._thread.join(5)
+        super(QueueLogHandler, self).close()
 
 
 stream = logging.StreamHandler(sys.stdout)
 logger.addFilter(ResellerNameFilter())
-formatter = JsonLogFormatter() if os.getenv('JSON_LOG') else ConnectorLogFormatter()
+if os.getenv('JSON_LOG'):
+    formatter = JsonLogFormatter()
+else:
+    formatter = ConnectorLogFormatter(indent=4 if os.getenv('PRETTY_LOG') else None)
 stream.setFormatter(formatter)
+log_queue = QueueLogHandler(stream, capacity=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
 logger.setLevel(logging.DEBUG)
-logger.addHandler(stream)
+logger.addHandler(log_queue)
+
 
+def cap_body(raw, limit):
+    """Return ``raw`` cut to ``limit`` bytes with a truncation marker, None if it fits."""
+    if not limit or raw is None:
+        return None
+    if not isinstance(raw, bytes):
+        raw = raw.encode('utf-8')
+    if len(raw) <= limit:
+        return None
+    return u'{}...[truncated {} bytes]'.format(raw[:limit].decode('utf-8', 'replace'),
+                                               len(raw) - limit)
 
-def log_request(request):
-    if request.data:
+
+def log_request(request, timestamp=None, body_limit=None):
+    data = cap_body(request.get_data(), body_limit)
+    if data is None and request.is_json:
+        data = request.get_json(silent=True)
+    if data is None:
+        raw = request.get_data()
         try:
-            data = json.loads(request.data)
+            data = codec.loads(raw)
         except:
-            data = request.data.decode('utf-8')
-    else:
-        data = request.data.decode('utf-8')
+            data = raw.decode('utf-8')
     return {"type": "request",
             "app": "fallball_connector",
             "method": request.method,
             "url": request.url,
             "headers": parse_headers(request.headers),
-            "time": datetime.datetime.now().isoformat(' '),
+            "time": (timestamp or datetime.datetime.now()).isoformat(' '),
             "data": data}
 
 
-def log_response(response):
-    if response.content_type == 'application/json':
-        try:
-            data = json.loads(response.data)
-        except:
+def log_response(response, body_limit=None):
+    data = cap_body(response.get_data(), body_limit)
+    if data is None:
+        data = getattr(response, 'json_body', None)
+    if data is None:
+        if response.content_type == 'application/json':
+            try:
+                data = codec.loads(response.data)
+            except:
+                data = response.data.decode()
+        else:
             data = response.data.decode()
-    else:
-        data = response.data.decode()
 
     return {"type": "response",
             "app": "fallball_connector",
@@ -101,27 +208,247 @@ def log_response(response):
             "company": getattr(g, 'company_name', None)}
 
 
-def log_outgoing_request(request):
+def log_outgoing_request(request, timestamp=None, body_limit=None):
+    data = cap_body(request.body, body_limit)
     return {"app": "fallball_connector",
             "method": request.method,
             "url": request.url,
             "headers": parse_headers(request.headers),
-            "time": datetime.datetime.now().isoformat(' '),
-            "data": request.body}
+            "time": (timestamp or datetime.datetime.now()).isoformat(' '),
+            "data": request.body if data is None else data}
 
 
-def log_outgoing_response(response):
-    try:
-        data = json.loads(response.content)
-    except:
-        data = response.content.decode()
+def log_outgoing_response(response, timestamp=None, body_limit=None):
+    data = cap_body(response.content, body_limit)
+    if data is None:
+        try:
+            data = codec.response_json(response)
+        except:
+            data = response.content.decode()
     return {"app": "fallball_connector",
             "status": response.status_code,
             "headers": parse_headers(response.headers),
-            "time": datetime.datetime.now().isoformat(' '),
+            "time": (timestamp or datetime.datetime.now()).isoformat(' '),
             "data": data}
 
 
+class OutgoingExchange(object):
+    __slots__ = ('request', 'response', 'sent', 'received', 'started', 'duration', 'body_limit')
+
+    def __init__(self, request, body_limit=None):
+        self.request = request
+        self.body_limit = body_limit
+        self.response = None
+        self.sent = datetime.datetime.now()
+        self.received = None
+        self.started = clock()
+        self.duration = None
+
+    def done(self, response):
+        self.response = response
+        self.received = datetime.datetime.now()
+        self.duration = clock() - self.started
+
+    def to_dict(self):
+        response = None
+        if self.response is not None:
+            response = log_outgoing_response(self.response, self.received, self.body_limit)
+        duration = None if self.duration is None else round(self.duration * 1000, 1)
+        return {'request': log_outgoing_request(self.request, self.sent, self.body_limit),
+                'response': response,
+                'duration_ms': duration}
+
+
+class RequestTimings(object):
+    """Time spent by one request waiting for upstreams, per upstream.
+
+    Calls made in parallel by ``connector.fanout`` overlap, so besides the
+    time of every upstream the time with at least one call in flight is kept;
+    the rest of the request is the connector's own time.
+    """
+
+    def __init__(self):
+        self.started = clock()
+        self.upstreams = {}
+        self.waiting = 0.0
+        self._in_flight = 0
+        self._waiting_since = None
+        self._lock = threading.Lock()
+
+    def call_started(self):
+        now = clock()
+        with self._lock:
+            if self._in_flight == 0:
+                self._waiting_since = now
+            self._in_flight += 1
+        return now
+
+    def call_done(self, upstream, started):
+        now = clock()
+        with self._lock:
+            calls, duration = self.upstreams.get(upstream, (0, 0.0))
+            self.upstreams[upstream] = (calls + 1, duration + now - started)
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.waiting += now - self._waiting_since
+        return now - started
+
+    def summary(self):
+        total = clock() - self.started
+        with self._lock:
+            upstreams = dict(self.upstreams)
+            waiting = self.waiting
+        return {'total_ms': round(total * 1000, 1),
+                'upstream_ms': round(waiting * 1000, 1),
+                'self_ms': round(max(0.0, total - waiting) * 1000, 1),
+                'upstreams': {name: {'calls': calls, 'ms': round(duration * 1000, 1)}
+                              for name, (calls, duration) in upstreams.items()}}
+
+    @staticmethod
+    def server_timing(summary):
+        """Format a summary as a Server-Timing header value."""
+        metrics = ['{};dur={};desc="{} calls"'.format(name, upstream['ms'], upstream['calls'])
+                   for name, upstream in sorted(summary['upstreams'].items())]
+        metrics.append('app;dur={}'.format(summary['self_ms']))
+        metrics.append('total;dur={}'.format(summary['total_ms']))
+        return ', '.join(metrics)
+
+
+class RequestLog(object):
+    """Keeps references to the inbound request and outbound exchanges of one request.
+
+    Log records are only built by ``record()``, so nothing is decoded or
+    copied for requests that are not going to be logged. At most
+    ``max_exchanges`` exchanges are kept, further ones are only counted, and
+    logged bodies are cut to ``body_limit`` bytes.
+    """
+
+    def __init__(self, max_exchanges=None, body_limit=None):
+        self.started = datetime.datetime.now()
+        self.out = []
+        self.dropped = 0
+        self.max_exchanges = max_exchanges
+        self.body_limit = body_limit
+
+    def outgoing(self, request):
+        if self.max_exchanges is not None and len(self.out) >= self.max_exchanges:
+            self.dropped += 1
+            return None
+        exchange = OutgoingExchange(request, self.body_limit)
+        self.out.append(exchange)
+        return exchange
+
+    def child(self):
+        """Return an empty log with the same limits, for a task of connector.fanout."""
+        return RequestLog(self.max_exchanges, self.body_limit)
+
+    def merge(self, other):
+        room = len(other.out)
+        if self.max_exchanges is not None:
+            room = max(0, min(room, self.max_exchanges - len(self.out)))
+        self.out.extend(other.out[:room])
+        self.dropped += other.dropped + len(other.out) - room
+
+    def record(self, request, response):
+        record = {'request': log_request(request, self.started, self.body_limit),
+                  'out': [exchange.to_dict() for exchange in self.out],
+                  'response': log_response(response, self.body_limit)}
+        if self.dropped:
+            record['out_dropped'] = self.dropped
+        return record
+
+
+class LogSampler(object):
+    """Picks 1 in ``rate`` requests for the debug log, and every failed or slow one."""
+
+    def __init__(self, rate=1, slow_threshold=None):
+        self.rate = max(1, rate)
+        self.slow_threshold = slow_threshold
+        self._count = itertools.count()
+
+    def sample(self, status_code, duration):
+        if status_code >= 400:
+            return True
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            return True
+        return next(self._count) % self.rate == 0
+
+
+# log of the current task while a request fans out to worker threads, see connector.fanout
+task_log = threading.local()
+
+
+def debug_log_enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def start_request_log():
+    g.log = RequestLog(config.debug_log_max_exchanges,
+                       config.debug_log_body_limit) if debug_log_enabled() else None
+
+
+debug_log_sampler = LogSampler(config.debug_log_sample_rate, config.debug_log_slow_threshold)
+
+
+def request_timings():
+    if has_app_context():
+        return getattr(g, 'timings', None)
+    return None
+
+
+class UpstreamCall(object):
+    """Times one call to an upstream for the request timings and the metrics.
+
+    Set ``status`` once the response is in and call ``done()`` in any case.
+    """
+
+    __slots__ = ('target', 'method', 'status', 'timings', 'started')
+
+    def __init__(self, target, method):
+        self.target = target
+        self.method = method
+        self.status = 'error'
+        self.timings = request_timings()
+        self.started = self.timings.call_started() if self.timings else clock()
+        upstream_in_flight.inc(target)
+
+    def done(self):
+        upstream_in_flight.dec(self.target)
+        if self.timings:
+            duration = self.timings.call_done(self.target, self.started)
+        else:
+            duration = clock() - self.started
+        upstream_duration.observe(duration, self.target, self.method, self.status)
+        return duration
+
+
+def request_log():
+    log = getattr(task_log, 'log', None)
+    if log is not None:
+        return log
+    if has_app_context():
+        return getattr(g, 'log', None)
+    return None
+
+
+class ConnectorRequest(Request):
+    def get_json(self, force=False, silent=False, cache=True):
+        data = getattr(self, '_cached_json', None)
+        if cache and data is not None:
+            return data
+
+        if not (force or self.is_json):
+            return None
+
+        try:
+            data = codec.loads(self.get_data(cache=cache))
+        except ValueError as e:
+            data = None if silent else self.on_json_loading_failed(e)
+        if cache:
+            self._cached_json = data
+        return data
+
+
 def escape_domain_name(name):
     valid_name = re.sub(r'[^a-zA-Z0-9-.]', '-', name)
     valid_name = re.sub(r'(^-+)|(-+$)', '', valid_name)
@@ -1,19 +1,23 @@
+import math
 import random
 import string
 
 from collections import namedtuple
 
-from flask import Blueprint, g, request
+from flask import Blueprint, current_app, g, make_response, request
 from flask_restful import Api, abort
 from requests_oauthlib import OAuth1
 from faker import Faker
 
+from connector import codec
 from connector.config import Config
-from connector.utils import log_request, log_response
-from connector.validator import check_oauth_signature, get_client_key
+from connector.metrics import request_duration, requests_in_flight
+from connector.resilience import UpstreamUnavailable
+from connector.utils import RequestTimings, debug_log_sampler, start_request_log
+from connector.validator import verify_request
 from connector.fbclient.reseller import Reseller
 
-from connector.v1.resources import urlify
+from connector.v1.resources import oa_resources, outbox, urlify
 from connector.v1.resources.application import (Application, ApplicationList,
                                                 ApplicationTenantDelete, ApplicationTenantNew,
                                                 ApplicationUpgrade, HealthCheck,
@@ -54,8 +58,7 @@ def set_name_for_reseller(reseller_id):
     return get_reseller_name(reseller_id)
 
 
-def get_oauth():
-    client_key = get_client_key(request)
+def get_oauth(client_key):
     client_secret = Config().oauth_secret
     if not client_key or not client_secret:
         return None
@@ -63,25 +66,34 @@ def get_oauth():
                   client_secret=client_secret)
 
 
-def get_reseller_info():
+def get_reseller_info(client_key):
     reseller_id = request.headers.get('Aps-Instance-Id')
     is_new = g.endpoint == ApplicationList.__name__.lower()
     reseller_name = set_name_for_reseller(reseller_id)
-    oauth = get_oauth()
+    oauth = get_oauth(client_key)
     return ResellerInfo(id=reseller_id, name=reseller_name, is_new=is_new, auth=oauth)
 
 
+@api_bp.before_app_first_request
+def start_outbox():
+    # deliver messages left by a previous run without waiting for new ones
+    if outbox is not None:
+        outbox.start()
+
+
 @api_bp.before_request
 def before_request():
-    g.log = dict()
-    g.log['out'] = list()
-    g.log['request'] = log_request(request)
+    g.timings = RequestTimings()
+    g.in_flight = True
+    requests_in_flight.inc()
+    start_request_log()
 
     g.endpoint = request.endpoint
     if request.blueprint:
         g.endpoint = g.endpoint[len(request.blueprint):].lstrip('.')
 
-    reseller_info = get_reseller_info()
+    oauth_result = verify_request(request)
+    reseller_info = get_reseller_info(oauth_result.client_key)
     g.reseller_name = reseller_info.name
     g.company_name = 'N/A'
 
@@ -89,13 +101,12 @@ def before_request():
         allow_public_endpoints_only()
         return
 
-    if not check_oauth_signature(request):
+    if not oauth_result.valid:
         abort(401)
 
     g.auth = reseller_info.auth
 
-    g.reseller = Reseller(reseller_info.name, reseller_info.id, None)
-    g.reseller.refresh()
+    g.reseller = Reseller.get(reseller_info.name, reseller_info.id)
 
     if not g.reseller.token and not reseller_info.is_new:
         abort(403)
@@ -103,11 +114,30 @@ def before_request():
 
 @api_bp.after_request
 def after_request(response):
-    g.log['response'] = log_response(response)
-    logger.debug(g.log)
+    endpoint = g.get('endpoint') or 'unknown'
+    timings = g.timings.summary()
+    duration = timings['total_ms'] / 1000.0
+    if g.log and debug_log_sampler.sample(response.status_code, duration):
+        record = g.log.record(request, response)
+        saved = oa_resources.request_stats()['saved']
+        if saved:
+            record['oa_requests_saved'] = saved
+        logger.debug(record)
+
+    response.headers['Server-Timing'] = RequestTimings.server_timing(timings)
+    timings.update({'type': 'timing', 'method': request.method, 'endpoint': endpoint,
+                    'status': response.status_code})
+    logger.info(timings)
+    request_duration.observe(duration, endpoint, request.method, response.status_code)
     return response
 
 
+@api_bp.teardown_request
+def teardown_request(exception):
+    if g.pop('in_flight', False):
+        requests_in_flight.dec()
+
+
 resource_routes = {
     '/': HealthCheck,
     '/app': ApplicationList,
@@ -135,12 +165,37 @@ resource_routes = {
 class FallballApi(Api):
     def handle_error(self, e):
         code = getattr(e, 'code', 500)
+        headers = {}
+        retry_after = getattr(e, 'retry_after', None)
+        if retry_after is not None:
+            headers['Retry-After'] = str(int(math.ceil(retry_after)))
         response = self.make_response({'message': str(e),
                                        'error': type(e).__name__},
-                                      code)
+                                      code, headers=headers)
         return response
 
 api = FallballApi(api_bp, catch_all_404s=True)
 
+
+@api_bp.app_errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    # the blueprint is renamed once registered, so flask-restful does not route errors
+    # of the first registration to handle_error
+    return api.handle_error(e)
+
+
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    settings = current_app.config.get('RESTFUL_JSON', {})
+    if current_app.debug:
+        settings.setdefault('indent', 4)
+        settings.setdefault('sort_keys', True)
+
+    response = make_response(codec.dumps(data, **settings) + "\n", code)
+    response.headers.extend(headers or {})
+    if g.get('log'):
+        response.json_body = data
+    return response
+
 for route, resource in resource_routes.items():
     api.add_resource(resource, route, strict_slashes=False)
@@ -1,10 +1,12 @@
 from collections import namedtuple
+from functools import partial
 import re
-import json
-from time import time
+import threading
+from time import sleep, time
 
 import requests
-from requests import Request, Session
+from requests import Request
+from requests_oauthlib import OAuth1
 
 try:
     from functools import reduce
@@ -17,41 +19,43 @@ except ImportError:
     from urlparse import urljoin
     from urllib import quote as urlquote
 
-from flask import g, request
+from flask import g, has_app_context, has_request_context, request
 
-from flask_restful import Resource
+from flask_restful import Resource, reqparse
 
 from slumber.exceptions import HttpClientError, HttpServerError
 
-from connector.utils import log_outgoing_request, log_outgoing_response
-
-ErrorResponse = namedtuple("ErrorResponse", "status_code text")
-
-OA_CACHE_LIFETIME = 30  # seconds
+from connector import codec
+from connector.cache import TTLCache
+from connector.config import Config
+from connector.dispatcher import Dispatcher
+from connector.fanout import parallel
+from connector.metrics import upstream_retries
+from connector.outbox import Outbox
+from connector.pool import SessionPool
+from connector.resilience import Backoff, CircuitBreakers, RetryBudget
+from connector.utils import UpstreamCall, logger, request_log
 
+config = Config()
 
-class Memoize(object):
-    def __init__(self, function):
-        self.timeout = 0
-        self.function = function
-        self.memoized = {}
-        self.memoized_ts = {}
+ErrorResponse = namedtuple("ErrorResponse", "status_code text")
 
-    def __call__(self, *args):
-        now = time()
+ApplicationSchema = namedtuple("ApplicationSchema",
+                               "application user tenant user_resources counters loaded")
 
-        if args not in self.memoized or \
-                self.timeout and now > self.memoized_ts[args] + self.timeout:
-            self.memoized[args] = self.function(*args)
-            self.memoized_ts[args] = now
+oa_sessions = SessionPool(size=config.oa_pool_size, maxsize=config.oa_pool_maxsize,
+                          idle_timeout=config.oa_pool_idle_timeout)
 
-        return self.memoized[args]
+OA_SERVER_ERRORS = (500, 502, 503, 504)
 
+oa_backoff = Backoff(config.oa_backoff_base, config.oa_backoff_max)
+oa_breakers = CircuitBreakers(config.oa_breaker_threshold, config.oa_breaker_reset_timeout)
 
-class Memoize_timeout(Memoize):
-    def __init__(self, function):
-        super(Memoize_timeout, self).__init__(function)
-        self.timeout = OA_CACHE_LIFETIME
+notification_managers = TTLCache(config.notification_manager_ttl, maxsize=100)
+notifications = Dispatcher('notification', workers=config.notification_workers,
+                           capacity=config.notification_queue_size,
+                           retries=config.notification_retries,
+                           retry_delay=config.notification_retry_delay)
 
 
 def parameter_validator(*args):
@@ -78,6 +82,21 @@ def make_error(e):
     return {'message': e.response.text.strip('"')}, e.response.status_code
 
 
+class JsonArgument(reqparse.Argument):
+    # APS sends JSON only, reading just the cached decoded body skips parsing
+    # form and query values for every argument
+    def __init__(self, name, location='json', **kwargs):
+        super(JsonArgument, self).__init__(name, location=location, **kwargs)
+
+
+def json_parser():
+    """Return a RequestParser reading arguments from the JSON body.
+
+    Parsers keep no per-request state, build them once and reuse them.
+    """
+    return reqparse.RequestParser(argument_class=JsonArgument)
+
+
 class ConnectorResource(Resource):
     def dispatch_request(self, *args, **kwargs):
         try:
@@ -86,6 +105,34 @@ class ConnectorResource(Resource):
             return make_error(e)
 
 
+class RQL(object):
+    """Builds an RQL query for ``aps/2/resources``, e.g.
+    ``RQL().implementing(user_type).eq('aps.id', user_id).select('tenant', 'user')``.
+    """
+
+    def __init__(self):
+        self.terms = []
+
+    @staticmethod
+    def _quote(value):
+        return urlquote(str(value), safe=':/')
+
+    def implementing(self, aps_type):
+        self.terms.append('implementing({})'.format(self._quote(aps_type)))
+        return self
+
+    def eq(self, name, value):
+        self.terms.append('{}={}'.format(name, self._quote(value)))
+        return self
+
+    def select(self, *relations):
+        self.terms.append('select({})'.format(','.join(relations)))
+        return self
+
+    def __str__(self):
+        return 'aps/2/resources?{}'.format(','.join(self.terms))
+
+
 class OACommunicationException(Exception):
     def __init__(self, resp):
         msg = "Request to OA failed."
@@ -99,15 +146,24 @@ class OA(object):
     request_timeout = 50
 
     @staticmethod
-    def get_notification_manager():
-        rql_request = 'aps/2/resources?implementing({})'.format(
-            urlquote('http://www.parallels.com/pa/pa-core-services/notification-manager/1'))
-        response = OA.send_request('get', rql_request, transaction=False)
-        return response[0]['aps']['id']
+    def get_notification_manager(oa_uri=None, auth=None):
+        if oa_uri is None:
+            oa_uri = request.headers.get('aps-controller-uri')
+            auth = g.get('auth')
+
+        def find():
+            rql_request = 'aps/2/resources?implementing({})'.format(
+                urlquote('http://www.parallels.com/pa/pa-core-services/notification-manager/1'))
+            response = OA.send_request('get', rql_request, transaction=False,
+                                       oa_uri=oa_uri, auth=auth)
+            return response[0]['aps']['id']
+
+        return notification_managers.get_or_load(oa_uri, find)
 
     @staticmethod
     def send_notification(message, details=None, message_keys=None, account_id=None,
                           status='ready', user_id=None, link=None):
+        """Queue a notification, it is posted to OA in the background."""
         notification = {
             'status': status,
             'message': {
@@ -132,8 +188,17 @@ class OA(object):
         if initiator_id is not None:
             notification['initiatorId'] = initiator_id
 
-        rql_request = 'aps/2/resources/{}/notifications'.format(OA.get_notification_manager())
-        return OA.send_request('post', rql_request, notification, transaction=False)
+        if outbox is not None and OA.queue({'kind': 'notification', 'body': notification}):
+            return
+        notifications.submit(OA.post_notification, notification,
+                             request.headers.get('aps-controller-uri'), g.get('auth'))
+
+    @staticmethod
+    def post_notification(notification, oa_uri, auth):
+        rql_request = 'aps/2/resources/{}/notifications'.format(
+            OA.get_notification_manager(oa_uri, auth))
+        return OA.send_request('post', rql_request, notification, transaction=False,
+                               oa_uri=oa_uri, auth=auth)
 
     @staticmethod
     def subscribe_on(resource_id='', event_type='', handler='', relation='',
@@ -149,10 +214,45 @@ class OA(object):
         rql_request = 'aps/2/resources/{}/aps/subscriptions'.format(resource_id)
         return OA.send_request('post', rql_request, subscription)
 
+    @staticmethod
+    def send_later(method, path, body=None):
+        """Send a request that OA accepts late, through the outbox if it is enabled.
+
+        Without the outbox, or when it can not be written, the request is sent
+        right away and its response is returned, otherwise it is queued outside
+        of the APS transaction. Only requests that may be repeated belong here;
+        a queued request replaces a pending one to the same path.
+        """
+        if outbox is not None and OA.queue({'kind': 'request', 'method': method, 'path': path,
+                                            'body': body}, key='{} {}'.format(method, path)):
+            return
+        return OA.send_request(method, path, body)
+
+    @staticmethod
+    def queue(message, key=None):
+        """Store a message for ``deliver`` in the outbox with the controller and client
+        of the current request, False if the outbox could not store it."""
+        auth_client = getattr(g.get('auth'), 'client', None)
+        message['client_key'] = getattr(auth_client, 'client_key', None)
+        return outbox.put(request.headers.get('aps-controller-uri'), message, key=key)
+
+    @staticmethod
+    def deliver(oa_uri, message):
+        client_key = message.get('client_key')
+        auth = OAuth1(client_key=client_key, client_secret=config.oauth_secret) \
+            if client_key else None
+        if message.get('kind') == 'notification':
+            OA.post_notification(message['body'], oa_uri, auth)
+            return
+        OA.send_request(message['method'], message['path'], message['body'], transaction=False,
+                        oa_uri=oa_uri, auth=auth)
+
     @staticmethod
     def get_resource(resource_id, transaction=True, retry_num=10):
         rql_request = 'aps/2/resources/{}'.format(resource_id)
-        return OA.send_request('get', rql_request, transaction=transaction, retry_num=retry_num)
+        return oa_resources.get(rql_request, lambda: OA.send_request(
+            'get', rql_request, transaction=transaction, retry_num=retry_num),
+            transaction=transaction)
 
     @staticmethod
     def put_resource(representation, transaction=True, impersonate_as=None, retry_num=10):
@@ -164,11 +264,19 @@ class OA(object):
 
     @staticmethod
     def get_resources(rql_request, transaction=True, retry_num=10):
-        return OA.send_request('get', rql_request, transaction=transaction, retry_num=retry_num)
+        return oa_resources.get(rql_request, lambda: OA.send_request(
+            'get', rql_request, transaction=transaction, retry_num=retry_num),
+            transaction=transaction)
 
     @staticmethod
-    def send_request(method, path, body=None, transaction=True, impersonate_as=None, retry_num=10):
-        oa_uri = request.headers.get('aps-controller-uri')
+    def send_request(method, path, body=None, transaction=True, impersonate_as=None, retry_num=10,
+                     oa_uri=None, auth=None):
+        if oa_uri is None:
+            oa_uri = request.headers.get('aps-controller-uri')
+            if auth is None:
+                auth = g.auth
+            if method.lower() != 'get':
+                oa_resources.clear()
         url = urljoin(oa_uri, path)
 
         headers = {'Content-Type': 'application/json'}
@@ -177,74 +285,288 @@ class OA(object):
         if transaction and request.headers.get('aps-transaction-id'):
             headers['aps-transaction-id'] = request.headers.get('aps-transaction-id')
 
-        data = None if body is None else json.dumps(body)
+        data = None if body is None else codec.dumps(body)
 
         retry_num = retry_num if retry_num > 0 else 1
+        log = request_log()
+        breaker = oa_breakers.get(oa_uri)
+        budget = RetryBudget.current(config.oa_retry_budget, config.oa_request_deadline)
 
-        with Session() as s:
+        with oa_sessions.session(oa_uri) as s:
             prepared = Request(
                 method=method,
                 url=url,
                 data=data,
                 headers=headers,
-                auth=g.auth
+                auth=auth
             ).prepare()
 
-            while retry_num > 0:
-                retry_num -= 1
+            attempt = 0
+            while True:
+                timeout = min(OA.request_timeout, budget.remaining())
+                if timeout <= 0:
+                    raise OACommunicationException(ErrorResponse(
+                        None, 'Deadline for requests to OA exceeded.'))
+                if not breaker.allow():
+                    raise OACommunicationException(ErrorResponse(
+                        None, 'Requests to OA at {} are suspended after repeated failures. '
+                              'Retry in {:.0f} seconds.'.format(oa_uri, breaker.retry_after())))
+
+                call = UpstreamCall('oa', prepared.method)
                 try:
-                    g.log['out'].append(dict(request=None, response=None))
-                    g.log['out'][-1]['request'] = log_outgoing_request(prepared)
-                    resp = s.send(prepared, timeout=OA.request_timeout, verify=False)
-                    g.log['out'][-1]['response'] = log_outgoing_response(resp)
+                    exchange = log.outgoing(prepared) if log else None
+                    resp = s.send(prepared, timeout=timeout, verify=False)
+                    call.status = resp.status_code
+                    if exchange:
+                        exchange.done(resp)
                 except requests.exceptions.Timeout:
+                    call.status = 'timeout'
+                    breaker.failure()
                     err = ErrorResponse(None, 'Request to OA timed out. '
-                                              'Timeout: {}'.format(OA.request_timeout))
+                                              'Timeout: {}'.format(timeout))
+                    raise OACommunicationException(err)
+                except requests.exceptions.RequestException as e:
+                    breaker.failure()
+                    err = ErrorResponse(None, str(e))
                     raise OACommunicationException(err)
                 except Exception as e:
+                    # not a sign of OA failing, leave the breaker alone
                     err = ErrorResponse(None, str(e))
                     raise OACommunicationException(err)
+                finally:
+                    call.done()
+
+                if resp.status_code in OA_SERVER_ERRORS:
+                    breaker.failure()
+                else:
+                    breaker.success()
 
                 if resp.status_code == 200:
-                    return resp.json()
+                    return codec.response_json(resp)
                 elif resp.status_code != 400:
                     raise OACommunicationException(resp)
 
-            raise OACommunicationException(resp)
+                attempt += 1
+                delay = oa_backoff.delay(attempt - 1)
+                if attempt >= retry_num or not budget.spend(delay):
+                    raise OACommunicationException(resp)
+                upstream_retries.inc('oa')
+                sleep(delay)
+
+    @staticmethod
+    def get_schemas():
+        return oa_schemas.get(request.headers.get('aps-controller-uri'), g.auth)
 
     @staticmethod
-    @Memoize_timeout
     def get_application_schema():
-        return OA.send_request('get', 'aps/2/application', transaction=False)
+        return OA.get_schemas().application
 
     @staticmethod
     def is_application_support_users():
         return True if OA.get_application_schema().get('user') else False
 
     @staticmethod
-    @Memoize_timeout
     def get_user_schema():
-        user_schema = {}
-        user_schema_uri = OA.get_application_schema().get('user', {}).get('schema')
-        if user_schema_uri:
-            user_schema = OA.send_request('get', user_schema_uri, transaction=False)
-        return user_schema
+        return OA.get_schemas().user
+
+    @staticmethod
+    def get_user_type():
+        return OA.get_user_schema().get('id')
+
+    @staticmethod
+    def get_user_service(user_service_id):
+        """Return the user service with its ``user`` and ``tenant`` links resolved.
+
+        Without the user service type RQL can not select links of a resource
+        by its id, then the service and its links are fetched one by one.
+        """
+        user_type = OA.get_user_type()
+        if user_type:
+            query = RQL().implementing(user_type).eq('aps.id', user_service_id) \
+                .select('tenant', 'user')
+            user_services = OA.get_resources(str(query))
+            if user_services:
+                return user_services[0]
+
+        path = '/aps/2/resources/{}/{{}}'.format(user_service_id)
+        user_service, users, tenants = parallel(
+            partial(OA.get_resource, user_service_id),
+            partial(OA.get_resources, path.format('user')),
+            partial(OA.get_resources, path.format('tenant')))
+        return dict(user_service, user=users[0], tenant=tenants[0])
 
     @staticmethod
-    @Memoize_timeout
     def get_tenant_schema():
-        tenant_schema = {}
-        tenant_schema_uri = OA.get_application_schema().get('tenant', {}).get('schema')
-        if tenant_schema_uri:
-            tenant_schema = OA.send_request('get', tenant_schema_uri, transaction=False)
-        return tenant_schema
+        return OA.get_schemas().tenant
 
     @staticmethod
     def get_user_resources():
-        return OA.get_user_schema().get('properties', {}).get('resource', {}).get('enum', [])
+        # the cached schemas are shared, callers get their own copy
+        return list(OA.get_schemas().user_resources)
 
     @staticmethod
     def get_counters():
-        props = OA.get_tenant_schema().get('properties', {})
-        counters = [name for name, value in props.items() if 'Counter' in value.get('type', '')]
-        return counters
+        return list(OA.get_schemas().counters)
+
+
+class ApplicationSchemaCache(object):
+    """Application, user and tenant schemas of the APS application, per OA controller.
+
+    A version is fresh for ``ttl`` seconds and is refreshed in the background
+    shortly before that. Until the refresh succeeds the old version is served
+    for up to ``stale_ttl`` more seconds, after that the next request loads
+    the schemas itself.
+    """
+
+    refresh_ahead = 0.8  # share of ttl after which a version is refreshed
+
+    def __init__(self, ttl=30, stale_ttl=300, maxsize=100):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._versions = TTLCache(ttl + stale_ttl, maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    @staticmethod
+    def load(oa_uri, auth):
+        def fetch(path):
+            return OA.send_request('get', path, transaction=False, oa_uri=oa_uri, auth=auth)
+
+        application = fetch('aps/2/application')
+        user_schema_uri = application.get('user', {}).get('schema')
+        user = fetch(user_schema_uri) if user_schema_uri else {}
+        tenant_schema_uri = application.get('tenant', {}).get('schema')
+        tenant = fetch(tenant_schema_uri) if tenant_schema_uri else {}
+
+        user_resources = tuple(user.get('properties', {}).get('resource', {}).get('enum', []))
+        counters = tuple(name for name, value in tenant.get('properties', {}).items()
+                         if 'Counter' in value.get('type', ''))
+        return ApplicationSchema(application=application, user=user, tenant=tenant,
+                                 user_resources=user_resources, counters=counters,
+                                 loaded=time())
+
+    def _refresh(self, oa_uri, auth):
+        try:
+            self._versions.set(oa_uri, self.load(oa_uri, auth))
+        except Exception:
+            logger.exception("Failed to refresh application schemas of %s", oa_uri)
+        finally:
+            with self._lock:
+                self._refreshing.discard(oa_uri)
+
+    def _refresh_in_background(self, oa_uri, auth):
+        with self._lock:
+            if oa_uri in self._refreshing:
+                return
+            self._refreshing.add(oa_uri)
+        thread = threading.Thread(target=self._refresh, args=(oa_uri, auth),
+                                  name='oa-schema-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def get(self, oa_uri, auth):
+        version = self._versions.get_or_load(oa_uri, lambda: self.load(oa_uri, auth))
+        if time() - version.loaded > self.ttl * self.refresh_ahead:
+            self._refresh_in_background(oa_uri, auth)
+        return version
+
+    def invalidate(self, oa_uri):
+        self._versions.invalidate(oa_uri)
+
+    def clear(self):
+        self._versions.clear()
+
+    def stats(self):
+        return self._versions.stats()
+
+
+class RequestResources(object):
+    """OA resources fetched while serving one request, with its own counts."""
+
+    def __init__(self):
+        self.cache = TTLCache(maxsize=0)
+        self.fetched = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    def count(self, fetched):
+        with self._lock:
+            if fetched:
+                self.fetched += 1
+            else:
+                self.saved += 1
+
+    def stats(self):
+        with self._lock:
+            return {'fetched': self.fetched, 'saved': self.saved}
+
+
+class ResourceIdentityMap(object):
+    """Serves repeated GETs of the same OA resource within a request from memory.
+
+    The map of a request lives in ``g`` and is shared by the threads of
+    ``connector.fanout``; a write to OA in the request empties it. Resources
+    are kept per OA controller and per transaction. Returned resources are
+    shared between callers and must not be modified.
+    """
+
+    def __init__(self):
+        self.fetched = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current():
+        if not has_app_context():
+            return None
+        return g.setdefault('oa_resources', RequestResources())
+
+    def get(self, path, fetch, transaction=True, oa_uri=None):
+        resources = self._current()
+        if resources is None:
+            return fetch()
+
+        if oa_uri is None and has_request_context():
+            oa_uri = request.headers.get('aps-controller-uri')
+        fetched = []
+
+        def load():
+            fetched.append(True)
+            return fetch()
+
+        resource = resources.cache.get_or_load((oa_uri, bool(transaction), path.lstrip('/')),
+                                               load)
+        resources.count(fetched)
+        with self._lock:
+            if fetched:
+                self.fetched += 1
+            else:
+                self.saved += 1
+        return resource
+
+    def clear(self):
+        resources = self._current()
+        if resources is not None:
+            resources.cache.clear()
+
+    def request_stats(self):
+        """Counts of the current request."""
+        resources = self._current()
+        return resources.stats() if resources is not None else {'fetched': 0, 'saved': 0}
+
+    def stats(self):
+        with self._lock:
+            return {'fetched': self.fetched, 'saved': self.saved}
+
+
+outbox = Outbox(config.outbox_path, OA.deliver, batch_size=config.outbox_batch_size,
+                max_attempts=config.outbox_max_attempts,
+                retry_delay=config.outbox_retry_delay,
+                max_retry_delay=config.outbox_max_retry_delay,
+                # one delivery is a single OA request, bounded by the request deadline
+                lease=2 * config.oa_request_deadline) if config.outbox_path else None
+
+oa_schemas = ApplicationSchemaCache(ttl=config.oa_schema_ttl,
+                                    stale_ttl=config.oa_schema_stale_ttl)
+
+oa_resources = ResourceIdentityMap()
@@ -1,24 +1,133 @@
+import threading
 import uuid
+from time import time
 
 import pkg_resources
 
 from flask import g
 
-from flask_restful import reqparse
-
+from connector.cache import MISSING, TTLCache
+from connector.config import Config
+from connector.fbclient import background_calls
 from connector.fbclient.reseller import Reseller
+from connector.utils import logger
+
+from . import ConnectorResource, json_parser, parameter_validator
 
-from . import ConnectorResource, Memoize, parameter_validator
+config = Config()
 
 env = pkg_resources.Environment()
 res = env._distmap.get('fallball-connector', [None])[0]
 version = res.version if res else ''
 
 
-@Memoize
+class ResellerIndex(object):
+    """Maps reseller rid to reseller name using a single Reseller.all() pass.
+
+    The map is rebuilt in the background once it is older than ``ttl`` seconds.
+    Unknown rids trigger at most one synchronous rebuild per ``miss_ttl`` seconds
+    and are then remembered as misses for ``miss_ttl`` seconds. Maps are built
+    without holding the lock and swapped in under it.
+    """
+
+    def __init__(self, ttl=300, miss_ttl=10):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._names = None
+        self._built = 0
+        self._lock = threading.Lock()
+        # serializes synchronous rebuilds, so concurrent misses list resellers once
+        self._rebuild_lock = threading.Lock()
+        self._refreshing = False
+        self._misses = TTLCache(miss_ttl)
+
+    def _rebuild(self):
+        names = {r.rid: r.name for r in Reseller.all()}
+        with self._lock:
+            self._names = names
+            self._built = time()
+
+    def _refresh(self):
+        try:
+            with background_calls():
+                self._rebuild()
+        except Exception:
+            logger.exception("Failed to refresh reseller index")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh, name='reseller-index-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def _lookup(self, rid):
+        """Return the name of ``rid``, whether the map is built and when."""
+        with self._lock:
+            if self._names is None:
+                return None, False, self._built
+            return self._names.get(rid), True, self._built
+
+    def get(self, rid):
+        name, loaded, built = self._lookup(rid)
+        if not loaded:
+            with self._rebuild_lock:
+                name, loaded, built = self._lookup(rid)
+                if not loaded:
+                    self._rebuild()
+                    name, loaded, built = self._lookup(rid)
+
+        if name is not None:
+            if time() - built > self.ttl:
+                self._refresh_in_background()
+            return name
+
+        if self._misses.get(rid) is not MISSING:
+            return None
+
+        with self._rebuild_lock:
+            name, loaded, built = self._lookup(rid)
+            if name is None and time() - built > self.miss_ttl:
+                self._rebuild()
+                name, loaded, built = self._lookup(rid)
+
+        if name is None:
+            self._misses.set(rid, True)
+        return name
+
+    def warm(self):
+        """Build the map now, e.g. before worker processes are forked."""
+        self._refresh()
+
+    def add(self, rid, name):
+        with self._lock:
+            if self._names is not None:
+                self._names[rid] = name
+        self._misses.invalidate(rid)
+
+    def discard(self, rid):
+        with self._lock:
+            if self._names is not None:
+                self._names.pop(rid, None)
+
+    def clear(self):
+        with self._lock:
+            self._names = None
+            self._built = 0
+        self._misses.clear()
+
+
+reseller_index = ResellerIndex(ttl=config.reseller_index_ttl,
+                               miss_ttl=config.reseller_index_miss_ttl)
+
+
 def get_reseller_name(reseller_id):
-    res = [r for r in Reseller.all() if r.rid == reseller_id]
-    return None if not res else res[0].name
+    return reseller_index.get(reseller_id)
 
 
 class HealthCheck(ConnectorResource):
@@ -27,21 +136,25 @@ class HealthCheck(ConnectorResource):
                 'version': version}
 
 
+application_parser = json_parser()
+application_parser.add_argument('aps', dest='aps_type', type=parameter_validator('type'),
+                                required=True, help='No APS type specified')
+application_parser.add_argument('aps', dest='aps_id', type=parameter_validator('id'),
+                                required=True, help='No APS id specified')
+
+
 class ApplicationList(ConnectorResource):
     def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('aps', dest='aps_type', type=parameter_validator('type'),
-                            required=True, help='No APS type specified')
-        parser.add_argument('aps', dest='aps_id', type=parameter_validator('id'),
-                            required=True, help='No APS id specified')
-        args = parser.parse_args()
+        args = application_parser.parse_args()
         g.reseller.create()
+        reseller_index.add(g.reseller.rid, g.reseller.name)
         return {'aps': {'type': args.aps_type, 'id': args.aps_id}, 'appId': str(uuid.uuid4())}, 201
 
 
 class Application(ConnectorResource):
     def delete(self, app_id):
         g.reseller.delete()
+        reseller_index.discard(g.reseller.rid)
         return {}, 204
 
 
@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
 
 from collections import namedtuple
+from functools import partial
 import hashlib
 import uuid
 
 from flask import g
-from flask_restful import reqparse, request
+from flask_restful import request
 from slumber.exceptions import HttpClientError
 
+from connector.cache import memoize
 from connector.config import Config
 from connector.error_codes import ACTIVATION_ERROR
+from connector.fanout import parallel
 from connector.fbclient.user import User as FbUser
 from connector.fbclient.client import Client
+from connector.resilience import UpstreamUnavailable
+from connector.tenant_index import TenantIndex
 from connector.utils import escape_domain_name
 
-from . import (ConnectorResource, Memoize, OA, OACommunicationException,
+from . import (ConnectorResource, OA, OACommunicationException, json_parser,
                parameter_validator, urlify)
 
 config = Config()
@@ -23,19 +28,42 @@ AnalysisResult = namedtuple('AnalysisResult', 'recoverable data')
 ProvisioningResult = namedtuple('ProvisioningResult', 'body status_code headers')
 
 
-@Memoize
+tenant_index = TenantIndex(config.tenant_index_path) if config.tenant_index_path else None
+
+
+@memoize(maxsize=config.tenant_cache_size)
 def get_name_for_tenant(tenant_id):
+    if tenant_index:
+        name = tenant_index.get(tenant_id)
+        if name:
+            return name
+
     tenant_resource = OA.get_resource(tenant_id)
     if 'tenantId' not in tenant_resource:
         raise KeyError("tenantId property is missing in OA resource {}".format(tenant_id))
+
+    if tenant_index:
+        tenant_index.set(tenant_id, tenant_resource['tenantId'])
     return tenant_resource['tenantId']
 
 
+def remember_tenant(tenant_id, name):
+    get_name_for_tenant.cache.set((tenant_id,), name)
+    if tenant_index:
+        tenant_index.set(tenant_id, name)
+
+
+def forget_tenant(tenant_id):
+    get_name_for_tenant.cache.invalidate((tenant_id,))
+    if tenant_index:
+        tenant_index.delete(tenant_id)
+
+
 def sync_tenant_usage_with_client(tenant_id, client):
     tenant = build_usage(client)
-    OA.send_request('put',
-                    'aps/2/application/tenant/{}'.format(tenant_id),
-                    tenant)
+    OA.send_later('put',
+                  'aps/2/application/tenant/{}'.format(tenant_id),
+                  tenant)
 
 
 def make_default_fallball_admin(client):
@@ -48,8 +76,9 @@ def make_default_fallball_admin(client):
     return user
 
 
-def get_tenant_args():
-    parser = reqparse.RequestParser()
+@memoize(maxsize=32)
+def get_tenant_parser(user_resources):
+    parser = json_parser()
 
     parser.add_argument('aps', dest='aps_id', type=parameter_validator('id'), required=True,
                         help='Missing aps.id in request')
@@ -72,11 +101,22 @@ def get_tenant_args():
     parser.add_argument(config.diskspace_resource, dest='storage_limit',
                         type=parameter_validator('limit'))
 
-    for user_resource in OA.get_user_resources():
+    for user_resource in user_resources:
         parser.add_argument(user_resource, dest='{}_limit'.format(user_resource.lower()),
                             type=parameter_validator('limit'))
 
-    return parser.parse_args()
+    return parser
+
+
+def get_tenant_args():
+    return get_tenant_parser(tuple(OA.get_user_resources())).parse_args()
+
+
+tenant_update_parser = json_parser()
+tenant_update_parser.add_argument(config.diskspace_resource, dest='storage_limit',
+                                  type=parameter_validator('limit'), required=False,
+                                  help='Missing {} limit in request'.format(
+                                      config.diskspace_resource))
 
 
 def analyze_service_error(data):
@@ -177,7 +217,8 @@ def report_error(message):
 
 
 def provision_fallball_client(args):
-    company_info = OA.get_resource(args.acc_id)
+    company_info, subscription = parallel(partial(OA.get_resource, args.acc_id),
+                                          partial(OA.get_resource, args.sub_id))
     company_name = urlify(company_info['companyName'])
     admin_email = company_info['techContact']['email']
 
@@ -195,7 +236,7 @@ def provision_fallball_client(args):
         },
     }
 
-    sub_id = OA.get_resource(args.sub_id)['subscriptionId']
+    sub_id = subscription['subscriptionId']
     company_name = '{}-sub{}'.format(company_name if company_name else 'Unnamed', sub_id)
     g.company_name = company_name
     storage_limit = args.storage_limit if args.storage_limit else 0
@@ -222,6 +263,8 @@ def provision_fallball_client(args):
         else:
             info.update(report_error(resp))
             return ProvisioningResult(info, 500, {})
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         info.update(report_error(str(e)))
         return ProvisioningResult(info, 500, {})
@@ -229,14 +272,14 @@ def provision_fallball_client(args):
     user = make_default_fallball_admin(client)
     user.update()
 
-    OA.subscribe_on(args.aps_id, 'http://aps-standard.org/core/events/linked',
-                    relation='users',
-                    source_type=args.aps_type,
-                    handler='onUsersChange')
-    OA.subscribe_on(args.aps_id, 'http://aps-standard.org/core/events/unlinked',
-                    relation='users',
-                    source_type=args.aps_type,
-                    handler='onUsersChange')
+    parallel(partial(OA.subscribe_on, args.aps_id, 'http://aps-standard.org/core/events/linked',
+                     relation='users',
+                     source_type=args.aps_type,
+                     handler='onUsersChange'),
+             partial(OA.subscribe_on, args.aps_id, 'http://aps-standard.org/core/events/unlinked',
+                     relation='users',
+                     source_type=args.aps_type,
+                     handler='onUsersChange'))
 
     status = 'reprovisioned' if args.status else ''
 
@@ -250,6 +293,8 @@ def provision_fallball_client(args):
     }
     tenant.update(build_usage(client))
 
+    # only a fully provisioned tenant is mapped to its client
+    remember_tenant(args.aps_id, client.name)
     return ProvisioningResult(tenant, 201, None)
 
 
@@ -275,11 +320,7 @@ class Tenant(ConnectorResource):
         return tenant
 
     def put(self, tenant_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument(config.diskspace_resource, dest='storage_limit',
-                            type=parameter_validator('limit'), required=False,
-                            help='Missing {} limit in request'.format(config.diskspace_resource))
-        args = parser.parse_args()
+        args = tenant_update_parser.parse_args()
         company_name = g.company_name = get_name_for_tenant(tenant_id)
         if args.storage_limit:
             client = Client(g.reseller, name=company_name,
@@ -291,6 +332,7 @@ class Tenant(ConnectorResource):
         company_name = g.company_name = get_name_for_tenant(tenant_id)
         client = Client(g.reseller, name=company_name)
         client.delete()
+        forget_tenant(tenant_id)
         return None, 204
 
 
@@ -1,11 +1,10 @@
 from flask import g
-from flask_restful import reqparse
 
 from connector.config import Config
 from connector.fbclient.client import Client
 from connector.fbclient.user import User as FbUser
 from connector.v1.resources.tenant import get_name_for_tenant, sync_tenant_usage_with_client
-from . import ConnectorResource, OA, parameter_validator
+from . import ConnectorResource, OA, json_parser, parameter_validator
 
 config = Config()
 
@@ -14,22 +13,27 @@ def generate_limit(user_type):
     return 10 if user_type == 'USERS' else len(user_type) + 10
 
 
+user_create_parser = json_parser()
+user_create_parser.add_argument('aps', dest='aps_type', type=parameter_validator('type'),
+                                required=True,
+                                help='Missing aps.type in request')
+user_create_parser.add_argument('tenant', dest='tenant_id',
+                                type=parameter_validator('aps', 'id'),
+                                required=True,
+                                help='Missing tenant in request')
+user_create_parser.add_argument('user', dest='user_id',
+                                type=parameter_validator('aps', 'id'),
+                                required=True,
+                                help='Missing aps.id in request')
+user_create_parser.add_argument('resource', dest='user_type', type=str, required=True)
+
+user_update_parser = json_parser()
+user_update_parser.add_argument('resource', dest='user_type', type=str, required=False)
+
+
 class UserList(ConnectorResource):
     def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('aps', dest='aps_type', type=parameter_validator('type'),
-                            required=True,
-                            help='Missing aps.type in request')
-        parser.add_argument('tenant', dest='tenant_id',
-                            type=parameter_validator('aps', 'id'),
-                            required=True,
-                            help='Missing tenant in request')
-        parser.add_argument('user', dest='user_id',
-                            type=parameter_validator('aps', 'id'),
-                            required=True,
-                            help='Missing aps.id in request')
-        parser.add_argument('resource', dest='user_type', type=str, required=True)
-        args = parser.parse_args()
+        args = user_create_parser.parse_args()
 
         company_name = g.company_name = get_name_for_tenant(args.tenant_id)
 
@@ -58,7 +62,7 @@ class User(ConnectorResource):
     def delete(self, user_id):
         user = make_fallball_user(user_id)
         g.company_name = user.client.name
-        oa_user = OA.get_resources('/aps/2/resources/{}/user'.format(user_id))[0]
+        oa_user = OA.get_user_service(user_id)['user']
 
         user.delete()
         send_after_delete_notification(oa_user)
@@ -66,9 +70,7 @@ class User(ConnectorResource):
         return {}, 204
 
     def put(self, user_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('resource', dest='user_type', type=str, required=False)
-        args = parser.parse_args()
+        args = user_update_parser.parse_args()
         user = make_fallball_user(user_id)
         user.refresh()
         client = user.client
@@ -83,13 +85,10 @@ class User(ConnectorResource):
 
             user.profile_type = args.user_type
 
-        # we can't merge 2 requests into one as we don't know user.aps.type
-        #   /aps/2/resources?aps.id=user_id,select(tenant,user) won't work
-        #   only /aps/2/resources?implementing(user.aps.type),
-        #     aps.id=user_id,select(tenant,user) will work
-        oa_user = OA.get_resources('/aps/2/resources/{}/user'.format(user_id))[0]
-        oa_tenant_id = OA.get_resources('/aps/2/resources/{}/tenant'
-                                        .format(user_id))[0]['aps']['id']
+        # fetched once with make_fallball_user, served by the request identity map here
+        oa_user_service = OA.get_user_service(user_id)
+        oa_user = oa_user_service['user']
+        oa_tenant_id = oa_user_service['tenant']['aps']['id']
         user.update()
         sync_tenant_usage_with_client(oa_tenant_id, client)
 
@@ -106,7 +105,7 @@ class UserLogin(ConnectorResource):
 
 
 def make_fallball_user(oa_user_service_id):
-    oa_user_service = OA.get_resource(oa_user_service_id)
+    oa_user_service = OA.get_user_service(oa_user_service_id)
     oa_tenant_id = oa_user_service['tenant']['aps']['id']
     client = Client(reseller=g.reseller, name=get_name_for_tenant(oa_tenant_id))
     user = FbUser(client=client, user_id=oa_user_service['userId'])
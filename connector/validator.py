@@ -1,8 +1,13 @@
+from collections import namedtuple
+
 from oauthlib import oauth1 as oauth
 
 from connector.config import Config
 
 
+OAuthResult = namedtuple('OAuthResult', 'valid client_key')
+
+
 class RequestValidator(oauth.RequestValidator):
     enforce_ssl = False
     secret = 'secret'
@@ -44,12 +49,19 @@ class RequestValidator(oauth.RequestValidator):
         return request
 
 
+validator = RequestValidator()
+
+
+def verify_request(request):
+    valid, oauth_request = validator.endpoint.validate_request(request.url, request.method,
+                                                               request.data, request.headers)
+    return OAuthResult(valid=valid,
+                       client_key=oauth_request.client_key if oauth_request else None)
+
+
 def check_oauth_signature(request):
-    return RequestValidator().validate_signature(request.url, request.method, request.data,
-                                                 request.headers)
+    return verify_request(request).valid
 
 
 def get_client_key(request):
-    oauth_request = RequestValidator().get_request(request.url, request.method, request.data,
-                                                   request.headers)
-    return oauth_request.client_key if oauth_request else None
+    return verify_request(request).client_key
@@ -16,7 +16,7 @@ with codecs.open(join(here, 'VERSION'), encoding='utf-8') as f:
     VERSION = f.read()
 
 install_reqs = parse_requirements(join(here, 'requirements.txt'), session=False)
-reqs = [str(ir.req) for ir in install_reqs]
+reqs = [str(ir.req) for ir in install_reqs if ir.match_markers()]
 
 
 setup(
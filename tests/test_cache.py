@@ -0,0 +1,119 @@
+import threading
+
+from flask_testing import TestCase
+from mock import MagicMock, patch
+
+from connector.app import app
+from connector.cache import MISSING, TTLCache, memoize
+
+
+class TestTTLCache(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    @patch('connector.cache.time')
+    def test_entry_expires(self, time_mock):
+        cache = TTLCache(ttl=60)
+        time_mock.return_value = 0
+        cache.set('reseller', 'token')
+        time_mock.return_value = 59
+        assert cache.get('reseller') == 'token'
+        time_mock.return_value = 60
+        assert cache.get('reseller') is MISSING
+
+    @patch('connector.cache.time')
+    def test_negative_entry(self, time_mock):
+        cache = TTLCache(ttl=60, negative_ttl=5)
+        time_mock.return_value = 0
+        cache.set('unknown', None)
+        assert cache.get('unknown') is None
+        time_mock.return_value = 5
+        assert cache.get('unknown') is MISSING
+
+    def test_negative_entry_disabled(self):
+        cache = TTLCache(ttl=60)
+        cache.set('unknown', None)
+        assert cache.get('unknown') is MISSING
+
+    def test_invalidate(self):
+        cache = TTLCache(ttl=60)
+        cache.set('reseller', 'token')
+        cache.invalidate('reseller')
+        assert cache.get('reseller') is MISSING
+
+    def test_least_recently_used_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is MISSING
+        assert cache.get('a') == 1
+        assert cache.stats()['evictions'] == 1
+
+    def test_no_ttl(self):
+        cache = TTLCache()
+        cache.set('tenant', 'name')
+        assert cache.get('tenant') == 'name'
+
+    def test_stats(self):
+        cache = TTLCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
+
+    def test_get_or_load_single_flight(self):
+        cache = TTLCache()
+        started = threading.Event()
+        release = threading.Event()
+        loader = MagicMock()
+
+        def slow_loader():
+            started.set()
+            release.wait()
+            return loader()
+
+        loader.return_value = 'value'
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(cache.get_or_load('key', slow_loader)))
+        leader.start()
+        started.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(cache.get_or_load('key', slow_loader)))
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+
+        assert results == ['value', 'value']
+        assert loader.call_count == 1
+
+    def test_get_or_load_error_not_cached(self):
+        cache = TTLCache()
+        loader = MagicMock(side_effect=[KeyError, 'value'])
+        with self.assertRaises(KeyError):
+            cache.get_or_load('key', loader)
+        assert cache.get_or_load('key', loader) == 'value'
+
+
+class TestMemoize(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_memoize(self):
+        function = MagicMock(side_effect=lambda x: x * 2)
+
+        @memoize(maxsize=10)
+        def double(x):
+            return function(x)
+
+        assert double(2) == 4
+        assert double(2) == 4
+        assert function.call_count == 1
+        assert double.cache.stats()['hits'] == 1
@@ -0,0 +1,49 @@
+from flask import request
+from flask_testing import TestCase
+from mock import MagicMock, patch
+
+from connector import codec
+from connector.app import app
+
+
+class TestCodec(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_loads_dumps(self):
+        assert codec.loads(b'{"a": [1, 2]}') == {'a': [1, 2]}
+        assert codec.loads(codec.dumps({'a': 'b'})) == {'a': 'b'}
+        assert codec.dumps({'a': 'b'}, indent=4) == '{\n    "a": "b"\n}'
+
+    @patch('connector.codec.ujson')
+    def test_fast_backend(self, ujson_mock):
+        ujson_mock.loads.return_value = {'fast': True}
+        ujson_mock.dumps.return_value = '{"fast": true}'
+        assert codec.loads('{}') == {'fast': True}
+        assert codec.dumps({}) == '{"fast": true}'
+
+    @patch('connector.codec.ujson')
+    def test_fast_backend_fallback(self, ujson_mock):
+        ujson_mock.loads.side_effect = ValueError
+        ujson_mock.dumps.side_effect = OverflowError
+        assert codec.loads('{"big": 18446744073709551616}') == {'big': 18446744073709551616}
+        assert codec.dumps({'big': 18446744073709551616}) == '{"big": 18446744073709551616}'
+        with self.assertRaises(ValueError):
+            codec.loads('not json')
+
+    def test_response_json_decoded_once(self):
+        response = MagicMock(content=b'{"a": 1}', _connector_json=None)
+        with patch('connector.codec.loads', wraps=codec.loads) as loads_mock:
+            assert codec.response_json(response) == {'a': 1}
+            assert codec.response_json(response) == {'a': 1}
+        assert loads_mock.call_count == 1
+
+    def test_request_json_decoded_once(self):
+        with app.test_request_context('/', method='POST', data='{"a": 1}',
+                                      content_type='application/json'):
+            with patch('connector.codec.loads', wraps=codec.loads) as loads_mock:
+                assert request.get_json() == {'a': 1}
+                assert request.json == {'a': 1}
+            assert loads_mock.call_count == 1
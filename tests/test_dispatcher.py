@@ -0,0 +1,52 @@
+import threading
+
+from flask_testing import TestCase
+from mock import MagicMock, patch
+
+from connector.app import app
+from connector.dispatcher import Dispatcher
+
+
+class TestDispatcher(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_submit(self):
+        dispatcher = Dispatcher('test', workers=2)
+        job = MagicMock()
+        dispatcher.submit(job, 1, key='value')
+        dispatcher.join()
+        job.assert_called_once_with(1, key='value')
+
+    @patch('connector.dispatcher.logger')
+    @patch('connector.dispatcher.sleep')
+    def test_failed_job(self, sleep_mock, logger_mock):
+        dispatcher = Dispatcher('test', workers=1, retries=2, retry_delay=0.5)
+        job = MagicMock(side_effect=ValueError)
+        dispatcher.submit(job)
+        dispatcher.join()
+        assert job.call_count == 3
+        assert [c[0][0] for c in sleep_mock.call_args_list] == [0.5, 1]
+        assert dispatcher.failed == 1
+        logger_mock.exception.assert_called()
+
+    @patch('connector.dispatcher.logger')
+    def test_full_queue(self, logger_mock):
+        dispatcher = Dispatcher('test', workers=1, capacity=1)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        dispatcher.submit(block)
+        started.wait(5)
+        dispatcher.submit(MagicMock())
+        dispatcher.submit(MagicMock())
+        release.set()
+        dispatcher.join()
+
+        assert dispatcher.dropped == 1
+        logger_mock.error.assert_called()
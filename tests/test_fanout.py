@@ -0,0 +1,76 @@
+import threading
+
+from flask import g, request
+from flask_testing import TestCase
+from mock import MagicMock, patch
+
+from connector.app import app
+from connector.fanout import Executor, parallel
+from connector.utils import RequestLog, request_log
+
+
+class TestParallel(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_results_and_context(self):
+        with self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = 'auth'
+            results = parallel(lambda: (g.auth, request.headers['aps-controller-uri']),
+                               lambda: g.auth)
+            assert results == [('auth', 'https://aps.com'), 'auth']
+            assert parallel(lambda: 1) == [1]
+
+    def test_shared_workers(self):
+        started = threading.Event()
+
+        def wait():
+            return started.wait(5)
+
+        def start():
+            started.set()
+            return threading.current_thread().name
+
+        with self.app.test_request_context():
+            with patch('connector.fanout.executor', Executor(workers=1)):
+                assert parallel(wait, start) == [True, 'fanout']
+
+    def test_busy_workers(self):
+        with self.app.test_request_context():
+            with patch('connector.fanout.executor', Executor(workers=1)):
+                results = parallel(lambda: parallel(lambda: 1, lambda: 2),
+                                   lambda: parallel(lambda: 3, lambda: 4))
+        assert results == [[1, 2], [3, 4]]
+
+    def test_log_order(self):
+        second_logged = threading.Event()
+        first, second = MagicMock(), MagicMock()
+
+        def first_call():
+            second_logged.wait(5)
+            request_log().outgoing(first)
+
+        def second_call():
+            request_log().outgoing(second)
+            second_logged.set()
+
+        with self.app.test_request_context():
+            g.log = RequestLog()
+            parallel(first_call, second_call)
+            assert [exchange.request for exchange in g.log.out] == [first, second]
+
+    def test_errors(self):
+        finished = []
+
+        def fail(message):
+            raise ValueError(message)
+
+        with self.app.test_request_context():
+            g.log = None
+            with self.assertRaises(ValueError) as e:
+                parallel(lambda: finished.append(1), lambda: fail('first'),
+                         lambda: fail('second'))
+        assert str(e.exception) == 'first'
+        assert finished == [1]
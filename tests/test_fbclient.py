@@ -0,0 +1,132 @@
+from flask_testing import TestCase
+from mock import MagicMock, patch
+from requests import Request
+from requests.cookies import MockRequest, MockResponse
+from requests.exceptions import ConnectionError
+
+from connector.app import app
+from connector.fbclient import ApiCache, background_calls, send_guarded
+from connector.fbclient.client import Client
+from connector.fbclient.reseller import Reseller
+from connector.fbclient.user import User
+from connector.resilience import AdaptiveLimiter, CircuitBreaker, UpstreamUnavailable
+from tests.utils import SetCookieHeaders
+
+
+class TestModels(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_client_dump(self):
+        client = Client(Reseller('reseller'), name='client', email='admin@client.io',
+                        storage={'limit': 10}, country='US')
+        assert client._dump == {'name': 'client', 'email': 'admin@client.io',
+                                'storage': {'limit': 10}, 'country': 'US',
+                                'is_integrated': True}
+        assert not hasattr(client, '__dict__')
+
+    def test_user_dump(self):
+        user = User(Client(Reseller('reseller'), name='client'), email='user@client.io',
+                    admin=True, storage={'limit': 2})
+        assert user._dump == {'email': 'user@client.io', 'admin': True, 'storage': {'limit': 2}}
+        assert not hasattr(user, '__dict__')
+
+    def test_reseller_dump_load(self):
+        reseller = Reseller('reseller', rid='rid', token='token', clients_amount=3)
+        assert reseller._dump == {'name': 'reseller', 'rid': 'rid', 'token': 'token'}
+        assert not hasattr(reseller, '__dict__')
+
+        copy = reseller.copy()
+        assert (copy.name, copy.rid, copy.token, copy.clients_amount) == \
+            ('reseller', 'rid', 'token', 3)
+
+
+class TestTransport(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+        self.limiter = AdaptiveLimiter(initial=1)
+        patch('connector.fbclient.fallball_breaker', self.breaker).start()
+        patch('connector.fbclient.fallball_limiter', self.limiter).start()
+        self.prepped = MagicMock(method='GET')
+        self.addCleanup(patch.stopall)
+
+    def test_send_guarded(self):
+        session = MagicMock()
+        session.send.return_value = MagicMock(status_code=200)
+        assert send_guarded(session, self.prepped) is session.send.return_value
+        assert session.send.call_args[1]['timeout']
+        assert self.limiter.in_flight == 0
+
+    def test_breaker_opens_on_server_error(self):
+        session = MagicMock()
+        session.send.return_value = MagicMock(status_code=503)
+        send_guarded(session, self.prepped)
+        assert self.breaker.state == CircuitBreaker.OPEN
+
+        with self.assertRaises(UpstreamUnavailable) as error:
+            send_guarded(session, self.prepped)
+        assert error.exception.retry_after > 0
+        assert session.send.call_count == 1
+        assert self.limiter.in_flight == 0
+
+    def test_connection_error(self):
+        session = MagicMock()
+        session.send.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            send_guarded(session, self.prepped)
+        assert self.breaker.state == CircuitBreaker.OPEN
+        assert self.limiter.in_flight == 0
+
+    def test_slow_background_call(self):
+        self.limiter.slow_threshold = 1
+        session = MagicMock()
+        session.send.return_value = MagicMock(status_code=200)
+        with patch('connector.utils.clock', side_effect=[0, 10, 20, 30]):
+            with background_calls():
+                send_guarded(session, self.prepped)
+            assert self.limiter.limit == 2
+            send_guarded(session, self.prepped)
+        assert self.limiter.limit == 1
+
+    def test_limit_reached(self):
+        self.limiter.acquire()
+        with self.assertRaises(UpstreamUnavailable):
+            send_guarded(MagicMock(), self.prepped)
+
+
+class TestApiCache(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_reuse_and_eviction(self):
+        cache = ApiCache('http://fallball.io/', size=2)
+        first = cache.get('first')
+        assert cache.get('first') is first
+        second = cache.get('second')
+        cache.get('first')
+        cache.get('third')
+        assert cache.get('first') is first
+        assert cache.get('second') is not second
+
+    def test_clear(self):
+        cache = ApiCache('http://fallball.io/')
+        first = cache.get('first')
+        with patch.object(cache.adapter, 'close') as close_mock:
+            cache.clear()
+        close_mock.assert_called_once_with()
+        assert cache.get('first') is not first
+
+    def test_no_cookies(self):
+        session = ApiCache('http://fallball.io/').get('token')._store['session']
+        request = MockRequest(Request('GET', 'http://fallball.io/v1/').prepare())
+        session.cookies.extract_cookies(MockResponse(SetCookieHeaders()), request)
+        assert len(session.cookies) == 0
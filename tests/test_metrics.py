@@ -0,0 +1,88 @@
+import os
+
+from flask_testing import TestCase
+from mock import patch
+
+from connector.app import app
+from connector.metrics import Counter, Gauge, Histogram, Registry, registry
+
+
+class TestMetrics(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+        self.client = app.test_client()
+
+        return app
+
+    def test_counter_and_gauge(self):
+        counter = Counter('retries_total', 'Retries.', ('target',))
+        counter.inc('oa')
+        counter.inc('oa', amount=2)
+        assert counter.value('oa') == 3
+        assert counter.render() == '# HELP retries_total Retries.\n' \
+                                   '# TYPE retries_total counter\n' \
+                                   'retries_total{target="oa"} 3'
+
+        gauge = Gauge('in_flight', 'In flight.')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        assert gauge.value() == 1
+
+    def test_histogram(self):
+        histogram = Histogram('duration_seconds', 'Duration.', ('endpoint',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'user')
+        histogram.observe(0.1, 'user')
+        histogram.observe(5, 'user')
+        assert histogram.render().split('\n')[2:] == [
+            'duration_seconds_bucket{endpoint="user",le="0.1"} 2',
+            'duration_seconds_bucket{endpoint="user",le="1.0"} 2',
+            'duration_seconds_bucket{endpoint="user",le="+Inf"} 3',
+            'duration_seconds_sum{endpoint="user"} 5.15',
+            'duration_seconds_count{endpoint="user"} 3']
+
+    def test_collector(self):
+        registry = Registry()
+        registry.collector('cache_hits_total', 'Hits.', 'counter', ('cache',),
+                           lambda: [(('tenants',), 2), (('a"b',), 1)])
+        assert registry.render() == '# HELP cache_hits_total Hits.\n' \
+                                    '# TYPE cache_hits_total counter\n' \
+                                    'cache_hits_total{cache="a\\"b"} 1\n' \
+                                    'cache_hits_total{cache="tenants"} 2\n'
+
+    @patch('connector.app.Config.metrics_token', 'secret')
+    def test_metrics_endpoint(self):
+        self.client.get('/connector/v1/')
+        res = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assert200(res)
+        assert res.content_type.startswith('text/plain')
+        body = res.data.decode()
+        pid = os.getpid()
+        assert 'connector_request_duration_seconds_count{{pid="{}",endpoint="healthcheck",' \
+               'method="GET",status="200"}}'.format(pid) in body
+        assert 'connector_requests_in_flight{{pid="{}"}} 0'.format(pid) in body
+        assert 'connector_cache_hits_total{{pid="{}",cache="oa_schemas"}}'.format(pid) in body
+        assert 'connector_circuit_breaker_open{{pid="{}",upstream="oa"}}'.format(pid) in body
+
+    def test_metrics_endpoint_auth(self):
+        with patch('connector.app.Config.metrics_token', None):
+            self.assert404(self.client.get('/metrics'))
+        with patch('connector.app.Config.metrics_token', 'secret'):
+            self.assert401(self.client.get('/metrics'))
+            self.assert401(self.client.get('/metrics', headers={'Authorization': 'Bearer x'}))
+
+    @patch('connector.app.outbox')
+    @patch('connector.app.oa_breakers')
+    def test_no_controllers_in_labels(self, oa_breakers_mock, outbox_mock):
+        oa_breakers_mock.stats.return_value = {
+            'https://a.aps.com': {'state': 'open', 'failures': 5, 'rejected': 2},
+            'https://b.aps.com': {'state': 'closed', 'failures': 0, 'rejected': 1}}
+        outbox_mock.stats.return_value = [
+            {'controller': 'https://a.aps.com', 'pending': 2, 'dead': None, 'oldest': 1},
+            {'controller': 'https://b.aps.com', 'pending': 1, 'dead': 1, 'oldest': 1}]
+        body = registry.render()
+        assert 'aps.com' not in body
+        assert 'connector_circuit_breaker_open{upstream="oa"} 1' in body
+        assert 'connector_circuit_breaker_rejected_total{upstream="oa"} 3' in body
+        assert 'connector_outbox_messages{state="pending"} 3' in body
+        assert 'connector_outbox_messages{state="dead"} 1' in body
@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+
+from flask_testing import TestCase
+from mock import MagicMock, patch
+
+from connector.app import app
+from connector.outbox import Outbox, main
+
+
+class TestOutbox(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outbox.db')
+        self.delivered = []
+        self.start_patcher = patch('connector.outbox.Outbox.start')
+        self.start_patcher.start()
+
+    def tearDown(self):
+        self.start_patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def deliver(self, controller, message):
+        if message.get('fail'):
+            raise ValueError('failed')
+        self.delivered.append((controller, message['n']))
+
+    def test_batch(self):
+        outbox = Outbox(self.path, self.deliver)
+        outbox.put('https://a', {'n': 1})
+        outbox.put('https://b', {'n': 2})
+        outbox.put('https://a', {'n': 3})
+
+        assert outbox.deliver_batch() == (3, 0)
+        assert self.delivered == [('https://a', 1), ('https://b', 2), ('https://a', 3)]
+        assert outbox.deliver_batch() == (0, 0)
+
+    def test_key_replaces_pending(self):
+        outbox = Outbox(self.path, self.deliver)
+        outbox.put('https://a', {'n': 1}, key='usage')
+        outbox.put('https://b', {'n': 2}, key='usage')
+        outbox.put('https://a', {'n': 3}, key='usage')
+
+        assert outbox.deliver_batch() == (2, 0)
+        assert sorted(self.delivered) == [('https://a', 3), ('https://b', 2)]
+
+    def test_key_waits_for_lease(self):
+        outbox = Outbox(self.path, self.deliver)
+        outbox.put('https://a', {'n': 1}, key='usage')
+        assert len(outbox._claim()) == 1
+        outbox.put('https://a', {'n': 2}, key='usage')
+        outbox.put('https://a', {'n': 3})
+
+        assert [row[2] for row in outbox._claim()] == ['{"n": 3}']
+        assert len(outbox.list()) == 3
+
+    def test_lease_renewed_before_delivery(self):
+        outbox = Outbox(self.path, self.deliver, lease=100)
+        other = Outbox(self.path, self.deliver, lease=100)
+        outbox.put('https://a', {'n': 1})
+        outbox.put('https://a', {'n': 2})
+        with patch('connector.outbox.time', return_value=1000):
+            first, second = outbox._claim()
+        rows = outbox._connection().execute('SELECT locked_until FROM messages ORDER BY id')
+        assert [row[0] for row in rows] == [1100, 1100]
+
+        with patch('connector.outbox.time', return_value=1150):
+            assert outbox._renew(first[0], first[4])
+        # the second lease ran out while the first message was delivered
+        with patch('connector.outbox.time', return_value=1200):
+            assert len(other._claim()) == 1
+            assert not outbox._renew(second[0], second[4])
+
+    @patch('connector.outbox.logger')
+    def test_failure_does_not_hold_back_others(self, logger_mock):
+        outbox = Outbox(self.path, self.deliver, retry_delay=10, max_attempts=2)
+        outbox.put('https://a', {'n': 1, 'fail': True})
+        outbox.put('https://a', {'n': 2})
+        outbox.put('https://b', {'n': 3})
+
+        assert outbox.deliver_batch() == (2, 1)
+        assert outbox.deliver_batch() == (0, 0)
+        assert self.delivered == [('https://a', 2), ('https://b', 3)]
+        logger_mock.exception.assert_called()
+
+        message = outbox.list()[0]
+        assert message['attempts'] == 1 and not message['dead']
+        assert message['last_error'] == 'failed'
+
+        assert outbox.deliver_batch(force=True) == (0, 1)
+        assert outbox.list()[0]['dead']
+        assert outbox.stats() == [{'controller': 'https://a', 'pending': 0, 'dead': 1,
+                                   'oldest': outbox.list()[0]['created']}]
+
+        assert outbox.retry() == 1
+        assert outbox.list()[0]['attempts'] == 0
+        assert outbox.purge() == 0
+        assert outbox.purge(dead_only=False) == 1
+
+    @patch('connector.outbox.logger')
+    def test_drain(self, logger_mock):
+        outbox = Outbox(self.path, self.deliver, batch_size=1, retry_delay=10)
+        for n in range(3):
+            outbox.put('https://a', {'n': n})
+        outbox.put('https://b', {'n': 3, 'fail': True})
+
+        assert outbox.drain() == 3
+        assert len(outbox.list()) == 1
+
+    @patch('connector.outbox.logger')
+    def test_put_failure(self, logger_mock):
+        outbox = Outbox(os.path.join(self.directory, 'missing', 'outbox.db'), self.deliver)
+        assert not outbox.put('https://a', {'n': 1})
+        logger_mock.exception.assert_called()
+
+    def test_lease(self):
+        outbox = Outbox(self.path, self.deliver)
+        other = Outbox(self.path, self.deliver)
+        outbox.put('https://a', {'n': 1})
+        assert len(outbox._claim()) == 1
+        assert other._claim() == []
+
+    def test_cli(self):
+        outbox = Outbox(self.path, self.deliver)
+        outbox.put('https://a', {'n': 1})
+        with patch('connector.v1.resources.outbox', outbox), \
+                patch('connector.outbox.sys.stdout') as stdout_mock:
+            assert main(['drain']) == 0
+        assert '"delivered": 1' in stdout_mock.write.call_args[0][0]
+        assert self.delivered == [('https://a', 1)]
+
+        with patch('connector.v1.resources.outbox', None), \
+                patch('connector.outbox.sys.stderr', MagicMock()):
+            assert main(['stats']) == 1
@@ -0,0 +1,69 @@
+from flask_testing import TestCase
+from mock import patch
+from requests import Request
+from requests.cookies import MockRequest, MockResponse
+
+from connector.app import app
+from connector.pool import SessionPool
+from tests.utils import SetCookieHeaders
+
+
+class TestSessionPool(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_session_reused_per_key(self):
+        pool = SessionPool()
+        with pool.session('https://oa-1') as first:
+            pass
+        with pool.session('https://oa-1') as second:
+            pass
+        with pool.session('https://oa-2') as third:
+            pass
+
+        assert first is second
+        assert first is not third
+        assert pool.stats() == {'hits': 1, 'misses': 2, 'sessions': 2}
+
+    @patch('connector.pool.time')
+    def test_idle_session_recreated(self, time_mock):
+        pool = SessionPool(idle_timeout=60)
+        time_mock.return_value = 0
+        with pool.session('https://oa') as first:
+            pass
+        time_mock.return_value = 61
+        with pool.session('https://oa') as second:
+            pass
+
+        assert first is not second
+        assert pool.stats()['misses'] == 2
+
+    @patch('connector.pool.time')
+    def test_busy_session_not_recreated(self, time_mock):
+        pool = SessionPool(idle_timeout=60)
+        time_mock.return_value = 0
+        with pool.session('https://oa') as first:
+            time_mock.return_value = 61
+            with pool.session('https://oa') as second:
+                pass
+
+        assert first is second
+
+    def test_least_recently_used_session_closed(self):
+        pool = SessionPool(size=1)
+        with pool.session('https://oa-1') as first:
+            pass
+        with patch.object(first, 'close') as close_mock:
+            with pool.session('https://oa-2'):
+                pass
+            close_mock.assert_called()
+
+        assert pool.stats()['sessions'] == 1
+
+    def test_no_cookies(self):
+        with SessionPool().session('https://oa') as session:
+            request = MockRequest(Request('GET', 'https://oa/aps/2/resources').prepare())
+            session.cookies.extract_cookies(MockResponse(SetCookieHeaders()), request)
+            assert len(session.cookies) == 0
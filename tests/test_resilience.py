@@ -0,0 +1,92 @@
+from flask import g
+from flask_testing import TestCase
+from mock import patch
+
+from connector.app import app
+from connector.resilience import (AdaptiveLimiter, Backoff, CircuitBreaker, CircuitBreakers,
+                                  RetryBudget)
+
+
+class TestResilience(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_backoff(self):
+        backoff = Backoff(base=0.5, cap=3)
+        with patch('connector.resilience.random.uniform', side_effect=lambda a, b: b):
+            assert [backoff.delay(attempt) for attempt in range(5)] == [0.5, 1, 2, 3, 3]
+
+    def test_retry_budget(self):
+        budget = RetryBudget(retries=2, deadline=10)
+        assert budget.spend(1)
+        assert not budget.spend(20)
+        assert budget.spend(1)
+        assert not budget.spend(1)
+
+        with patch('connector.resilience.time', return_value=0):
+            budget = RetryBudget(retries=5, deadline=10)
+        with patch('connector.resilience.time', return_value=11):
+            assert budget.remaining() < 0
+            assert not budget.spend(0)
+
+    def test_retry_budget_per_request(self):
+        with self.app.test_request_context():
+            budget = RetryBudget.current(3, 10)
+            assert RetryBudget.current(3, 10) is budget
+            assert g.retry_budget is budget
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+        with patch('connector.resilience.time', return_value=100):
+            breaker.failure()
+            assert breaker.allow()
+            breaker.failure()
+            assert breaker.state == CircuitBreaker.OPEN
+            assert not breaker.allow()
+            assert breaker.retry_after() == 30
+
+        with patch('connector.resilience.time', return_value=131):
+            assert breaker.allow()
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            assert not breaker.allow()
+            breaker.failure()
+            assert breaker.state == CircuitBreaker.OPEN
+
+        with patch('connector.resilience.time', return_value=162):
+            assert breaker.allow()
+            breaker.success()
+            assert breaker.state == CircuitBreaker.CLOSED
+            assert breaker.allow()
+        assert breaker.stats() == {'state': 'closed', 'failures': 0, 'rejected': 2}
+
+    def test_circuit_breakers(self):
+        breakers = CircuitBreakers(threshold=1)
+        breakers.get('https://a').failure()
+        assert breakers.get('https://a') is breakers.get('https://a')
+        breakers.get('https://b')
+        assert breakers.stats() == {
+            'https://a': {'state': 'open', 'failures': 1, 'rejected': 0},
+            'https://b': {'state': 'closed', 'failures': 0, 'rejected': 0}}
+
+    def test_adaptive_limiter(self):
+        limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=3, slow_threshold=5)
+        assert limiter.acquire()
+        assert limiter.acquire()
+        assert not limiter.acquire()
+
+        limiter.release(True, 1)
+        limiter.release(True, 1)
+        assert limiter.stats() == {'limit': 2, 'in_flight': 0, 'rejected': 1}
+        assert round(limiter.limit, 2) == 2.9
+
+        limiter.acquire()
+        limiter.release(True, 10)
+        assert round(limiter.limit, 2) == 1.45
+        limiter.acquire()
+        limiter.release(False)
+        assert limiter.limit == 1
+        limiter.acquire()
+        limiter.release()
+        assert limiter.limit == 1
@@ -0,0 +1,49 @@
+from flask_testing import TestCase
+from mock import patch
+
+from connector import server
+from connector.app import app
+from connector.config import Config
+from connector.metrics import upstream_retries
+
+
+class TestServer(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    @patch('connector.server.multiprocessing.cpu_count', return_value=6)
+    def test_server_options(self, cpu_count_mock):
+        options = server.server_options(Config(), environ={'CONNECTOR_PORT': '80'})
+        assert options['bind'] == '0.0.0.0:80'
+        assert options['workers'] == 6
+        assert options['threads'] == Config.server_threads
+        assert options['preload_app']
+        assert options['max_requests'] == Config.server_max_requests
+
+        options = server.server_options(Config(), environ={'CONNECTOR_WORKERS': '2',
+                                                           'CONNECTOR_THREADS': '4'})
+        assert (options['workers'], options['threads']) == (2, 4)
+
+    def test_server_config(self):
+        options = server.server_options(Config(), environ={'CONNECTOR_WORKERS': '3'})
+        connector_server = server.ConnectorServer(options)
+        assert connector_server.cfg.workers == 3
+        assert connector_server.cfg.worker_class_str == 'gthread'
+        assert connector_server.cfg.post_fork is server.post_fork
+
+    @patch('connector.v1.resources.application.reseller_index')
+    def test_load_warms_caches(self, reseller_index_mock):
+        loaded = server.ConnectorServer(server.server_options(Config())).load()
+        assert loaded is app
+        reseller_index_mock.warm.assert_called_once_with()
+
+    @patch('connector.fbclient.fallball_apis')
+    @patch('connector.v1.resources.oa_sessions')
+    def test_post_fork(self, oa_sessions_mock, fallball_apis_mock):
+        upstream_retries.inc('oa')
+        server.post_fork(None, None)
+        oa_sessions_mock.clear.assert_called_once_with()
+        fallball_apis_mock.clear.assert_called_once_with()
+        assert upstream_retries.value('oa') == 0
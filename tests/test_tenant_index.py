@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+
+from flask_testing import TestCase
+
+from connector.app import app
+from connector.tenant_index import TenantIndex
+
+
+class TestTenantIndex(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tenants.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_set_get_delete(self):
+        index = TenantIndex(self.path)
+        assert index.get('123') is None
+        index.set('123', 'fake_company')
+        assert index.get('123') == 'fake_company'
+        index.delete('123')
+        assert index.get('123') is None
+
+    def test_shared_between_instances(self):
+        TenantIndex(self.path).set('123', 'fake_company')
+        assert TenantIndex(self.path).get('123') == 'fake_company'
+
+    def test_storage_error_is_a_miss(self):
+        index = TenantIndex(os.path.join(self.directory, 'missing', 'tenants.db'))
+        index.set('123', 'fake_company')
+        assert index.get('123') is None
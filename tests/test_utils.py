@@ -1,7 +1,14 @@
+import threading
+
+from flask import g
 from flask_testing import TestCase
 from logging import LogRecord
+from mock import MagicMock, patch
 from connector.app import app
-from connector.utils import ConnectorLogFormatter, JsonLogFormatter
+from connector.metrics import upstream_duration
+from connector.utils import (ConnectorLogFormatter, JsonLogFormatter, QueueLogHandler,
+                             LogSampler, RequestLog, RequestTimings, UpstreamCall, cap_body,
+                             logger, start_request_log)
 from datetime import datetime
 
 
@@ -57,3 +64,177 @@ class TestUtils(TestCase):
         }
         actual_record = formatter.format(record)
         assert 'fake_text' in actual_record
+
+
+class TestRequestLog(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    def test_record(self):
+        log = RequestLog()
+        outgoing_request = MagicMock(method='GET', url='https://fallball/resellers/', body=None,
+                                     headers={})
+        outgoing_response = MagicMock(status_code=200, content=b'{"name": "reseller"}',
+                                      headers={}, _connector_json=None)
+        log.outgoing(outgoing_request).done(outgoing_response)
+        request = MagicMock(is_json=True, method='POST', url='https://connector/tenant',
+                            headers={})
+        request.get_json.return_value = {'aps': {}}
+        response = MagicMock(content_type='application/json', data=b'{}', status_code=201,
+                             status='201 CREATED', headers={}, json_body=None)
+
+        record = log.record(request, response)
+        assert record['request']['data'] == {'aps': {}}
+        assert record['out'][0]['request']['url'] == 'https://fallball/resellers/'
+        assert record['out'][0]['response']['data'] == {'name': 'reseller'}
+        assert record['response']['status_code'] == 201
+        assert record['out'][0]['duration_ms'] >= 0
+
+    def test_record_without_response(self):
+        log = RequestLog()
+        log.outgoing(MagicMock(method='GET', url='https://oa', body=None, headers={}))
+        request = MagicMock(is_json=False, headers={})
+        request.get_data.return_value = b''
+        record = log.record(request, MagicMock(content_type='text/plain', data=b'', headers={},
+                                               json_body=None))
+        assert record['out'][0]['response'] is None
+
+    def test_bounded(self):
+        log = RequestLog(max_exchanges=2, body_limit=8)
+        outgoing_request = MagicMock(method='POST', url='https://oa', body='{"name": "long name"}',
+                                     headers={})
+        assert log.outgoing(outgoing_request)
+        child = log.child()
+        child.outgoing(outgoing_request)
+        child.outgoing(outgoing_request)
+        log.merge(child)
+        assert log.outgoing(outgoing_request) is None
+        assert (len(log.out), log.dropped) == (2, 2)
+
+        request = MagicMock(is_json=True, method='POST', url='https://connector/tenant',
+                            headers={})
+        request.get_data.return_value = b'{"aps": {"id": "123"}}'
+        response = MagicMock(content_type='application/json', status_code=200,
+                             status='200 OK', headers={}, json_body=None)
+        response.data = response.get_data.return_value = b'{}'
+        record = log.record(request, response)
+        assert record['request']['data'] == '{"aps": ...[truncated 14 bytes]'
+        assert record['out'][0]['request']['data'] == '{"name":...[truncated 13 bytes]'
+        assert record['response']['data'] == {}
+        assert record['out_dropped'] == 2
+
+    def test_cap_body(self):
+        assert cap_body(b'12345', 5) is None
+        assert cap_body(None, 5) is None
+        assert cap_body(b'123456', None) is None
+        assert cap_body(u'\u00e9\u00e9\u00e9', 4) == u'\u00e9\u00e9...[truncated 2 bytes]'
+
+    def test_sampler(self):
+        sampler = LogSampler(rate=3, slow_threshold=2)
+        assert [sampler.sample(200, 0.1) for _ in range(6)] == [True, False, False] * 2
+        assert sampler.sample(500, 0.1)
+        assert sampler.sample(404, 0.1)
+        assert sampler.sample(200, 2.5)
+
+    def test_capture_disabled(self):
+        with patch.object(logger, 'isEnabledFor', return_value=False):
+            start_request_log()
+        assert g.log is None
+
+    def test_capture_enabled(self):
+        with patch.object(logger, 'isEnabledFor', return_value=True):
+            start_request_log()
+        assert isinstance(g.log, RequestLog)
+
+
+class TestRequestTimings(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    @patch('connector.utils.clock')
+    def test_summary(self, clock_mock):
+        clock_mock.return_value = 0.0
+        timings = RequestTimings()
+        # two parallel OA calls from 1 to 3 and from 2 to 4, then FallBall from 5 to 6
+        clock_mock.return_value = 1
+        first = timings.call_started()
+        clock_mock.return_value = 2
+        second = timings.call_started()
+        clock_mock.return_value = 3
+        timings.call_done('oa', first)
+        clock_mock.return_value = 4
+        timings.call_done('oa', second)
+        clock_mock.return_value = 5
+        third = timings.call_started()
+        clock_mock.return_value = 6
+        timings.call_done('fallball', third)
+        clock_mock.return_value = 10
+
+        summary = timings.summary()
+        assert summary == {'total_ms': 10000, 'upstream_ms': 4000, 'self_ms': 6000,
+                           'upstreams': {'oa': {'calls': 2, 'ms': 4000},
+                                         'fallball': {'calls': 1, 'ms': 1000}}}
+        assert RequestTimings.server_timing(summary) == \
+            'fallball;dur=1000.0;desc="1 calls", oa;dur=4000.0;desc="2 calls", ' \
+            'app;dur=6000.0, total;dur=10000.0'
+
+    def test_server_timing_header(self):
+        res = app.test_client().get('/connector/v1/')
+        assert 'app;dur=' in res.headers['Server-Timing']
+        assert 'total;dur=' in res.headers['Server-Timing']
+
+    def test_upstream_call(self):
+        with app.test_request_context():
+            g.timings = RequestTimings()
+            call = UpstreamCall('oa', 'GET')
+            call.status = 200
+            assert call.done() >= 0
+            assert g.timings.summary()['upstreams']['oa']['calls'] == 1
+        assert upstream_duration.samples()
+
+
+class TestQueueLogHandler(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+
+        return app
+
+    @staticmethod
+    def make_record(message):
+        return LogRecord('fake_name', 'DEBUG', None, None, message, None, None)
+
+    def test_records_written_in_background(self):
+        target = MagicMock()
+        handler = QueueLogHandler(target)
+        record = self.make_record('fake_message')
+        handler.emit(record)
+        handler.close()
+
+        target.handle.assert_called_once_with(record)
+        assert handler._thread.name == 'log-writer'
+
+    def test_overflow_dropped(self):
+        writing = threading.Event()
+        release = threading.Event()
+
+        def slow_write(record):
+            writing.set()
+            release.wait()
+
+        target = MagicMock()
+        target.handle.side_effect = slow_write
+        handler = QueueLogHandler(target, capacity=1)
+
+        handler.emit(self.make_record('first'))
+        writing.wait()
+        handler.emit(self.make_record('second'))
+        handler.emit(self.make_record('third'))
+        release.set()
+        handler.close()
+
+        assert handler.dropped == 1
+        assert target.handle.call_count == 2
@@ -1,3 +1,13 @@
 class InlineClass(object):
     def __init__(self, dict):
         self.__dict__ = dict
+
+
+class SetCookieHeaders(object):
+    """Response headers with a Set-Cookie, for ``requests.cookies.MockResponse``."""
+
+    def get_all(self, name, default):
+        return ['sessionid=1; Path=/'] if name.lower() == 'set-cookie' else default
+
+    def getheaders(self, name):
+        return self.get_all(name, [])
@@ -1,12 +1,16 @@
 import json
 
+from flask import request
 from flask_testing import TestCase
+from oauthlib import oauth1
 
-from mock import patch
+from mock import MagicMock, patch
 
 from connector.app import app
-from connector.v1.resources.application import get_reseller_name
+from connector.v1.resources.application import get_reseller_name, ResellerIndex
 from connector.config import Config
+from connector.resilience import UpstreamUnavailable
+from connector.validator import verify_request
 from tests.v1.utils import bypass_auth
 
 config = Config()
@@ -63,3 +67,107 @@ class TestApp(TestCase):
     def test_get_reseller_name(self, Reseller_mock):
         name = get_reseller_name(123)
         assert name is None
+
+    @bypass_auth
+    @patch('connector.v1.resources.application.ApplicationUpgrade.post')
+    def test_upstream_unavailable(self, post_mock):
+        post_mock.side_effect = UpstreamUnavailable('FallBall is unavailable', 2.5)
+        res = self.client.post('/connector/v1/app/123/upgrade?version=100-500',
+                               headers=self.headers)
+        assert res.status_code == 503
+        assert res.headers['Retry-After'] == '3'
+
+
+class TestOAuth(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+        return app
+
+    def test_verify_request(self):
+        client = oauth1.Client(config.oauth_key, client_secret=config.oauth_secret)
+        url, headers, body = client.sign('http://localhost/connector/v1/tenant', 'GET')
+        with app.test_request_context('/connector/v1/tenant', headers=headers):
+            result = verify_request(request)
+
+        assert result.valid
+        assert result.client_key == config.oauth_key
+
+    def test_verify_request_wrong_secret(self):
+        client = oauth1.Client(config.oauth_key, client_secret='wrong')
+        url, headers, body = client.sign('http://localhost/connector/v1/tenant', 'GET')
+        with app.test_request_context('/connector/v1/tenant', headers=headers):
+            result = verify_request(request)
+
+        assert not result.valid
+
+    @patch('connector.v1.verify_request', wraps=verify_request)
+    def test_request_verified_once(self, verify_mock):
+        self.client.get('/connector/v1/')
+        assert verify_mock.call_count == 1
+
+
+class TestResellerIndex(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+        return app
+
+    @staticmethod
+    def make_reseller(rid, name):
+        reseller = MagicMock()
+        reseller.rid = rid
+        reseller.name = name
+        return reseller
+
+    @patch('connector.v1.resources.application.Reseller')
+    def test_lookup_uses_single_listing(self, Reseller_mock):
+        Reseller_mock.all.return_value = [self.make_reseller('1', 'first'),
+                                          self.make_reseller('2', 'second')]
+        index = ResellerIndex()
+        assert index.get('1') == 'first'
+        assert index.get('2') == 'second'
+        assert Reseller_mock.all.call_count == 1
+
+    @patch('connector.cache.time')
+    @patch('connector.v1.resources.application.time')
+    @patch('connector.v1.resources.application.Reseller')
+    def test_miss_is_cached(self, Reseller_mock, time_mock, cache_time_mock):
+        time_mock.return_value = cache_time_mock.return_value = 100
+        Reseller_mock.all.return_value = []
+        index = ResellerIndex(miss_ttl=10)
+        assert index.get('unknown') is None
+        assert index.get('unknown') is None
+        assert Reseller_mock.all.call_count == 1
+
+        time_mock.return_value = cache_time_mock.return_value = 111
+        assert index.get('unknown') is None
+        assert Reseller_mock.all.call_count == 2
+
+    @patch('connector.v1.resources.application.Reseller')
+    def test_add_and_discard(self, Reseller_mock):
+        Reseller_mock.all.return_value = []
+        index = ResellerIndex()
+        assert index.get('new') is None
+        index.add('new', 'new-reseller')
+        assert index.get('new') == 'new-reseller'
+        index.discard('new')
+        assert index.get('new') is None
+        assert Reseller_mock.all.call_count == 1
+
+    @patch('connector.v1.resources.application.threading.Thread')
+    @patch('connector.v1.resources.application.time')
+    @patch('connector.v1.resources.application.Reseller')
+    def test_stale_index_refreshed_in_background(self, Reseller_mock, time_mock, Thread_mock):
+        time_mock.return_value = 0
+        Reseller_mock.all.return_value = [self.make_reseller('1', 'first')]
+        index = ResellerIndex(ttl=300)
+        assert index.get('1') == 'first'
+
+        time_mock.return_value = 301
+        Reseller_mock.all.return_value = [self.make_reseller('1', 'renamed')]
+        assert index.get('1') == 'first'
+        assert index.get('1') == 'first'
+        assert Thread_mock.call_count == 1
+
+        Thread_mock.call_args[1]['target']()
+        assert index.get('1') == 'renamed'
+        assert Reseller_mock.all.call_count == 2
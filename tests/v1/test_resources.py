@@ -1,13 +1,23 @@
+import threading
+from time import time
+
+from flask import g
 from flask_testing import TestCase
 
 from mock import patch, ANY, MagicMock, call
+from requests.exceptions import ConnectionError
 
 from slumber.exceptions import HttpClientError
 
+from connector import codec
 from connector.app import app
+from connector.dispatcher import Dispatcher
 
 from connector.v1.resources import parameter_validator, make_error, \
-    ConnectorResource, OA, OACommunicationException
+    ApplicationSchemaCache, ConnectorResource, OA, OACommunicationException, json_parser, \
+    notification_managers, oa_breakers, ResourceIdentityMap, RQL
+from connector.resilience import Backoff, CircuitBreakers, RetryBudget
+from connector.v1.resources.tenant import get_tenant_parser
 
 from connector.config import Config
 
@@ -27,6 +37,24 @@ class TestMethods(TestCase):
             validate({})
         assert validate({'fake_param': 1}) == 1
 
+    def test_json_parser(self):
+        parser = json_parser()
+        parser.add_argument('aps', dest='aps_id', type=parameter_validator('id'))
+        parser.add_argument('name')
+        with self.app.test_request_context('/?name=query', method='POST',
+                                           data='{"aps": {"id": "123"}}',
+                                           content_type='application/json'):
+            with patch('connector.codec.loads', wraps=codec.loads) as loads_mock:
+                args = parser.parse_args()
+            assert args.aps_id == '123'
+            assert args.name is None
+            loads_mock.assert_called_once()
+
+    def test_tenant_parser_reused(self):
+        parser = get_tenant_parser(('SILVER',))
+        assert get_tenant_parser(('SILVER',)) is parser
+        assert get_tenant_parser(('SILVER', 'GOLD')) is not parser
+
     def test_make_error(self):
         e = MagicMock()
         e.response = MagicMock()
@@ -59,19 +87,30 @@ class TestOA(TestCase):
     @bypass_auth
     @patch('connector.v1.resources.OA.send_request')
     def test_get_notification_manager(self, send_request_mock):
-        OA.get_notification_manager()
+        notification_managers.clear()
+        send_request_mock.return_value = [{'aps': {'id': 'manager'}}]
+        assert OA.get_notification_manager('https://aps.com', 'auth') == 'manager'
         send_request_mock.assert_called()
         url = send_request_mock.call_args[0][1]
         assert 'notification-manager/1' in url
 
+        assert OA.get_notification_manager('https://aps.com', 'auth') == 'manager'
+        send_request_mock.assert_called_once()
+        OA.get_notification_manager('https://other.com', 'auth')
+        assert send_request_mock.call_count == 2
+
     @bypass_auth
     @patch('connector.v1.resources.OA.send_request')
     def test_send_notification(self, send_request_mock):
-        OA.send_notification('fake_notification')
-        OA.send_notification('fake_notification', details='fake_notification_details')
-        OA.send_notification('fake_notification', details='fake_notification_details',
-                             message_keys={'details': 123},
-                             account_id='account123', status='error', user_id='user123')
+        dispatcher = Dispatcher('notification', workers=1)
+        with patch('connector.v1.resources.notifications', dispatcher), \
+                self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            OA.send_notification('fake_notification')
+            OA.send_notification('fake_notification', details='fake_notification_details')
+            OA.send_notification('fake_notification', details='fake_notification_details',
+                                 message_keys={'details': 123},
+                                 account_id='account123', status='error', user_id='user123')
+            dispatcher.join()
         send_request_mock.assert_called()
         expected_message = {
             'status': 'error',
@@ -89,6 +128,27 @@ class TestOA(TestCase):
         message = send_request_mock.call_args[0][2]
         assert message == expected_message
 
+    @patch('connector.dispatcher.sleep')
+    @patch('connector.v1.resources.OA.send_request')
+    def test_send_notification_retry(self, send_request_mock, sleep_mock):
+        notification_managers.clear()
+        send_request_mock.side_effect = [OACommunicationException(MagicMock()),
+                                         [{'aps': {'id': 'manager'}}],
+                                         OACommunicationException(MagicMock()),
+                                         {}]
+        dispatcher = Dispatcher('notification', workers=1, retries=3, retry_delay=1)
+        with patch('connector.v1.resources.notifications', dispatcher), \
+                self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = 'auth'
+            OA.send_notification('fake_notification')
+            dispatcher.join()
+
+        send_request_mock.assert_called_with('post', 'aps/2/resources/manager/notifications',
+                                             ANY, transaction=False, oa_uri='https://aps.com',
+                                             auth='auth')
+        sleep_mock.assert_has_calls([call(1), call(2)])
+        assert dispatcher.failed == 0
+
     @bypass_auth
     @patch('connector.v1.resources.OA.send_request')
     def test_subscribe_on(self, send_request_mock):
@@ -108,6 +168,61 @@ class TestOA(TestCase):
         subscription = send_request_mock.call_args[0][2]
         assert subscription == expected_subscription
 
+    @patch('connector.v1.resources.OA.send_request')
+    def test_send_later(self, send_request_mock):
+        outbox = MagicMock()
+        with self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = MagicMock()
+            g.auth.client.client_key = 'key'
+            with patch('connector.v1.resources.outbox', None):
+                OA.send_later('put', 'path', {'a': 1})
+            send_request_mock.assert_called_once_with('put', 'path', {'a': 1})
+
+            with patch('connector.v1.resources.outbox', outbox):
+                OA.send_later('put', 'path', {'a': 1})
+                OA.send_notification('fake_notification')
+        send_request_mock.assert_called_once()
+        outbox.put.assert_any_call('https://aps.com',
+                                   {'kind': 'request', 'method': 'put', 'path': 'path',
+                                    'body': {'a': 1}, 'client_key': 'key'},
+                                   key='put path')
+        message = outbox.put.call_args[0][1]
+        assert message['kind'] == 'notification'
+        assert message['body']['message'] == {'message': 'fake_notification'}
+        assert outbox.put.call_args[1] == {'key': None}
+
+    @patch('connector.v1.resources.notifications')
+    @patch('connector.v1.resources.OA.send_request')
+    def test_send_later_outbox_failure(self, send_request_mock, notifications_mock):
+        outbox = MagicMock()
+        outbox.put.return_value = False
+        with self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = None
+            with patch('connector.v1.resources.outbox', outbox):
+                OA.send_later('put', 'path', {'a': 1})
+                OA.send_notification('fake_notification')
+        send_request_mock.assert_called_once_with('put', 'path', {'a': 1})
+        notifications_mock.submit.assert_called_once()
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_deliver(self, send_request_mock):
+        OA.deliver('https://aps.com', {'kind': 'request', 'method': 'put', 'path': 'path',
+                                       'body': {'a': 1}, 'client_key': 'key'})
+        send_request_mock.assert_called_with('put', 'path', {'a': 1}, transaction=False,
+                                             oa_uri='https://aps.com', auth=ANY)
+        assert send_request_mock.call_args[1]['auth'].client.client_key == 'key'
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_deliver_notification(self, send_request_mock):
+        notification_managers.clear()
+        send_request_mock.return_value = [{'aps': {'id': 'manager'}}]
+        OA.deliver('https://aps.com', {'kind': 'notification', 'body': {'status': 'ready'},
+                                       'client_key': 'key'})
+        send_request_mock.assert_called_with('post', 'aps/2/resources/manager/notifications',
+                                             {'status': 'ready'}, transaction=False,
+                                             oa_uri='https://aps.com', auth=ANY)
+        assert send_request_mock.call_args[1]['auth'].client.client_key == 'key'
+
     @bypass_auth
     @patch('connector.v1.resources.OA.send_request')
     def test_get_resource(self, send_request_mock):
@@ -141,10 +256,12 @@ class TestOA(TestCase):
                                              transaction=False, retry_num=5)
 
     @bypass_auth
-    @patch('connector.v1.resources.Session')
+    @patch('connector.v1.resources.sleep')
+    @patch('connector.v1.resources.oa_sessions.session')
     @patch('connector.v1.resources.request')
     @patch('connector.v1.resources.g')
-    def test_send_request(self, flask_g_mock, flask_request_mock, session_mock):
+    def test_send_request(self, flask_g_mock, flask_request_mock, session_mock, sleep_mock):
+        oa_breakers.clear()
         fake_headers = {
             'aps-resource-id': 'fake_impersonation_resource_id',
             'aps-transaction-id': 'fake_transaction_id',
@@ -187,6 +304,120 @@ class TestOA(TestCase):
         with self.assertRaises(OACommunicationException):
             OA.send_request('post', 'fake_path', body=expected_body, retry_num=1)
 
+    def send_responses(self, session_mock, *status_codes):
+        responses = []
+        for status_code in status_codes:
+            response = MagicMock()
+            response.status_code = status_code
+            responses.append(response)
+        send_mock = session_mock.return_value.__enter__.return_value.send
+        send_mock.reset_mock()
+        send_mock.side_effect = responses
+        return send_mock
+
+    @patch('connector.v1.resources.oa_backoff', Backoff(base=1, cap=4))
+    @patch('connector.resilience.random.uniform', side_effect=lambda a, b: b)
+    @patch('connector.v1.resources.sleep')
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_send_request_backoff(self, session_mock, sleep_mock, uniform_mock):
+        send_mock = self.send_responses(session_mock, 400, 400, 400, 400, 200)
+        OA.send_request('get', 'path', oa_uri='https://backoff.aps.com')
+        assert send_mock.call_count == 5
+        sleep_mock.assert_has_calls([call(1), call(2), call(4), call(4)])
+
+    @patch('connector.v1.resources.config.oa_retry_budget', 3)
+    @patch('connector.v1.resources.sleep')
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_send_request_retry_budget(self, session_mock, sleep_mock):
+        with self.app.test_request_context():
+            send_mock = self.send_responses(session_mock, 400, 400, 400, 400)
+            with self.assertRaises(OACommunicationException):
+                OA.send_request('get', 'path', oa_uri='https://budget.aps.com')
+            assert send_mock.call_count == 4
+
+            # the budget is shared by all calls of the request
+            send_mock = self.send_responses(session_mock, 400, 400)
+            with self.assertRaises(OACommunicationException):
+                OA.send_request('get', 'path', oa_uri='https://budget.aps.com')
+            assert send_mock.call_count == 1
+
+    @patch('connector.v1.resources.sleep')
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_send_request_deadline(self, session_mock, sleep_mock):
+        with self.app.test_request_context():
+            g.retry_budget = RetryBudget(retries=10, deadline=0)
+            send_mock = self.send_responses(session_mock, 200)
+            with self.assertRaises(OACommunicationException) as e:
+                OA.send_request('get', 'path', oa_uri='https://deadline.aps.com')
+            assert 'Deadline' in str(e.exception)
+            send_mock.assert_not_called()
+
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_send_request_circuit_breaker(self, session_mock):
+        breakers = CircuitBreakers(threshold=2, reset_timeout=30)
+        patcher = patch('connector.v1.resources.oa_breakers', breakers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        send_mock = self.send_responses(session_mock, 500, 503, 200)
+        for _ in range(2):
+            with self.assertRaises(OACommunicationException):
+                OA.send_request('get', 'path', oa_uri='https://down.aps.com')
+
+        with self.assertRaises(OACommunicationException) as e:
+            OA.send_request('get', 'path', oa_uri='https://down.aps.com')
+        assert 'suspended' in str(e.exception)
+        assert send_mock.call_count == 2
+
+        with patch('connector.resilience.time', return_value=time() + 31):
+            OA.send_request('get', 'path', oa_uri='https://down.aps.com')
+        assert breakers.stats()['https://down.aps.com']['state'] == 'closed'
+
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_send_request_breaker_ignores_local_errors(self, session_mock):
+        breakers = CircuitBreakers(threshold=1, reset_timeout=30)
+        patcher = patch('connector.v1.resources.oa_breakers', breakers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        send_mock = session_mock.return_value.__enter__.return_value.send
+        send_mock.side_effect = TypeError('bad argument')
+        with self.assertRaises(OACommunicationException):
+            OA.send_request('get', 'path', oa_uri='https://aps.com')
+        assert breakers.stats()['https://aps.com']['state'] == 'closed'
+
+        send_mock.side_effect = ConnectionError('refused')
+        with self.assertRaises(OACommunicationException):
+            OA.send_request('get', 'path', oa_uri='https://aps.com')
+        assert breakers.stats()['https://aps.com']['state'] == 'open'
+
+    def test_rql(self):
+        query = RQL().implementing('http://fallball.io/user/1.0').eq('aps.id', 'a b') \
+            .select('tenant', 'user')
+        assert str(query) == 'aps/2/resources?implementing(http://fallball.io/user/1.0),' \
+                             'aps.id=a%20b,select(tenant,user)'
+
+    @patch('connector.v1.resources.OA.get_resources')
+    @patch('connector.v1.resources.OA.get_user_schema')
+    def test_get_user_service(self, get_user_schema_mock, get_resources_mock):
+        get_user_schema_mock.return_value = {'id': 'http://fallball.io/user/1.0'}
+        get_resources_mock.return_value = [{'userId': 'u', 'user': {}, 'tenant': {}}]
+        assert OA.get_user_service('123') == {'userId': 'u', 'user': {}, 'tenant': {}}
+        get_resources_mock.assert_called_once_with(
+            'aps/2/resources?implementing(http://fallball.io/user/1.0),aps.id=123,'
+            'select(tenant,user)')
+
+    @patch('connector.v1.resources.OA.get_resource')
+    @patch('connector.v1.resources.OA.get_resources')
+    @patch('connector.v1.resources.OA.get_user_schema')
+    def test_get_user_service_unknown_type(self, get_user_schema_mock, get_resources_mock,
+                                           get_resource_mock):
+        get_user_schema_mock.return_value = {}
+        get_resource_mock.return_value = {'userId': 'u', 'tenant': {'aps': {'id': 't'}}}
+        get_resources_mock.side_effect = lambda path: [{'path': path}]
+        assert OA.get_user_service('123') == {
+            'userId': 'u',
+            'user': {'path': '/aps/2/resources/123/user'},
+            'tenant': {'path': '/aps/2/resources/123/tenant'}}
+
     @bypass_auth
     @patch('connector.v1.resources.OA.get_application_schema')
     def test_is_application_support_users(self, get_application_schema_mock):
@@ -202,20 +433,148 @@ class TestOA(TestCase):
         self.assertFalse(OA.is_application_support_users())
 
     @bypass_auth
-    @patch('connector.v1.resources.OA.get_application_schema')
-    @patch('connector.v1.resources.OA.send_request')
-    def test_get_user_schema(self, send_request_mock, get_application_schema_mock):
-        get_application_schema_mock.return_value = {'user': {'schema': 'schema_uri'}}
-        send_request_mock.return_value = {'user': 'test-data'}
-
-        schema = OA.get_user_schema()
-        send_request_mock.assert_called_with('get', 'schema_uri', transaction=False)
+    @patch('connector.v1.resources.oa_schemas')
+    def test_get_user_schema(self, oa_schemas_mock):
+        oa_schemas_mock.get.return_value.user = {'user': 'test-data'}
+
+        with self.app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = 'auth'
+            schema = OA.get_user_schema()
+        oa_schemas_mock.get.assert_called_with('https://aps.com', 'auth')
         assert 'user' in schema
 
     @bypass_auth
-    @patch('connector.v1.resources.OA.get_user_schema')
-    def test_get_user_resources(self, get_user_schema_mock):
-        get_user_schema_mock.return_value = {
-            'properties': {'resource': {'enum': ['SILVER', 'BRILLIANT']}}}
+    @patch('connector.v1.resources.oa_schemas')
+    def test_get_user_resources(self, oa_schemas_mock):
+        oa_schemas_mock.get.return_value.user_resources = ('SILVER', 'BRILLIANT')
+
+        with self.app.test_request_context():
+            g.auth = 'auth'
+            assert OA.get_user_resources() == ['SILVER', 'BRILLIANT']
+
 
-        assert OA.get_user_resources() == ['SILVER', 'BRILLIANT']
+class TestApplicationSchemaCache(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+        return app
+
+    schemas = {
+        'aps/2/application': {'user': {'schema': 'user_schema'},
+                              'tenant': {'schema': 'tenant_schema'}},
+        'user_schema': {'properties': {'resource': {'enum': ['SILVER', 'BRILLIANT']}}},
+        'tenant_schema': {'properties': {'USERS': {'type': 'http://aps/types#Counter'},
+                                         'name': {'type': 'string'}}},
+    }
+
+    def fake_send_request(self, method, path, **kwargs):
+        return self.schemas[path]
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_load(self, send_request_mock):
+        send_request_mock.side_effect = self.fake_send_request
+        cache = ApplicationSchemaCache()
+
+        version = cache.get('https://aps.com', 'auth')
+        assert version.user_resources == ('SILVER', 'BRILLIANT')
+        assert version.counters == ('USERS',)
+        assert version.application == self.schemas['aps/2/application']
+        send_request_mock.assert_called_with('get', 'tenant_schema', transaction=False,
+                                             oa_uri='https://aps.com', auth='auth')
+
+        assert cache.get('https://aps.com', 'auth') is version
+        assert send_request_mock.call_count == 3
+
+        cache.get('https://other.com', 'auth')
+        assert send_request_mock.call_count == 6
+
+    @patch('connector.v1.resources.ApplicationSchemaCache._refresh_in_background')
+    @patch('connector.v1.resources.OA.send_request')
+    def test_stale_while_revalidate(self, send_request_mock, refresh_mock):
+        send_request_mock.side_effect = self.fake_send_request
+        cache = ApplicationSchemaCache(ttl=30, stale_ttl=300)
+
+        with patch('connector.v1.resources.time', return_value=1000):
+            version = cache.get('https://aps.com', 'auth')
+        refresh_mock.assert_not_called()
+
+        with patch('connector.v1.resources.time', return_value=1100):
+            assert cache.get('https://aps.com', 'auth') is version
+        refresh_mock.assert_called_once_with('https://aps.com', 'auth')
+        assert send_request_mock.call_count == 3
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_refresh(self, send_request_mock):
+        send_request_mock.side_effect = self.fake_send_request
+        cache = ApplicationSchemaCache()
+        version = cache.get('https://aps.com', 'auth')
+
+        cache._refresh_in_background('https://aps.com', 'auth')
+        for thread in threading.enumerate():
+            if thread.name == 'oa-schema-refresh':
+                thread.join()
+
+        assert cache.get('https://aps.com', 'auth') is not version
+        assert send_request_mock.call_count == 6
+
+    @patch('connector.v1.resources.logger')
+    @patch('connector.v1.resources.OA.send_request')
+    def test_failed_refresh_keeps_version(self, send_request_mock, logger_mock):
+        send_request_mock.side_effect = self.fake_send_request
+        cache = ApplicationSchemaCache()
+        version = cache.get('https://aps.com', 'auth')
+
+        send_request_mock.side_effect = OACommunicationException(MagicMock())
+        cache._refresh('https://aps.com', 'auth')
+
+        logger_mock.exception.assert_called()
+        assert cache.get('https://aps.com', 'auth') is version
+
+
+class TestResourceIdentityMap(TestCase):
+    def create_app(self):
+        app.config.update({'TESTING': True})
+        return app
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_duplicate_gets_sent_once(self, send_request_mock):
+        send_request_mock.side_effect = lambda method, path, **kwargs: {'path': path}
+        identity_map = ResourceIdentityMap()
+        with patch('connector.v1.resources.oa_resources', identity_map):
+            with app.test_request_context():
+                assert OA.get_resource('123') is OA.get_resource('123')
+                OA.get_resources('/aps/2/resources/123')
+                OA.get_resources('aps/2/resources/123/user')
+                OA.get_resource('123', transaction=False)
+                assert identity_map.request_stats() == {'fetched': 3, 'saved': 2}
+
+            g.pop('oa_resources')  # next request
+            OA.get_resource('123')
+
+        assert send_request_mock.call_count == 4
+        assert identity_map.stats() == {'fetched': 4, 'saved': 2}
+
+    @patch('connector.v1.resources.OA.send_request')
+    def test_separate_controllers(self, send_request_mock):
+        send_request_mock.side_effect = lambda method, path, **kwargs: {'path': path}
+        identity_map = ResourceIdentityMap()
+        with patch('connector.v1.resources.oa_resources', identity_map):
+            with app.test_request_context(headers={'aps-controller-uri': 'https://a.aps.com'}):
+                first = OA.get_resource('123')
+                assert identity_map.get('aps/2/resources/123', MagicMock(),
+                                        oa_uri='https://a.aps.com') is first
+                assert identity_map.get('aps/2/resources/123', lambda: None,
+                                        oa_uri='https://b.aps.com') is None
+
+    @patch('connector.v1.resources.oa_sessions.session')
+    def test_write_empties_map(self, session_mock):
+        response = MagicMock(status_code=200, content=b'{}', _connector_json=None)
+        session_mock.return_value.__enter__.return_value.send.return_value = response
+        send = session_mock.return_value.__enter__.return_value.send
+        with app.test_request_context(headers={'aps-controller-uri': 'https://aps.com'}):
+            g.auth = None
+            OA.get_resource('123')
+            OA.get_resource('123')
+            OA.put_resource({'aps': {'id': '123'}})
+            OA.get_resource('123')
+
+        assert send.call_count == 3
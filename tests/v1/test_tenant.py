@@ -9,9 +9,10 @@ from slumber.exceptions import HttpClientError, HttpServerError
 from connector.app import app
 from connector.config import Config
 from connector.fbclient.reseller import Reseller
+from connector.resilience import UpstreamUnavailable
 from connector.v1.resources import OACommunicationException
 from connector.v1.resources.tenant import get_name_for_tenant
-from tests.v1.utils import bypass_auth
+from tests.v1.utils import bypass_auth, resources_by_id
 
 
 config = Config()
@@ -48,7 +49,7 @@ class TestTenant(TestCase):
         self.new_tenant = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         config.diskspace_resource: {'limit': 1000},
                         'COUNTRY': {'limit': 0},
                         'ENVIRONMENT': {'limit': 0},
@@ -57,14 +58,14 @@ class TestTenant(TestCase):
         self.new_tenant_no_params = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         config.diskspace_resource: {'limit': 1000},
                         'accountInfo': {'addressPostal': {'postalCode': '11111'}},
                         'account': {'aps': {'id': 555}}})
         self.new_tenant_no_email = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         'COUNTRY': {'limit': 0},
                         'ENVIRONMENT': {'limit': 0},
                         config.diskspace_resource: {'limit': 1000},
@@ -73,14 +74,14 @@ class TestTenant(TestCase):
         self.fb_client_with_users = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         'USERS': {'limit': 10},
                         'accountInfo': {'addressPostal': {'postalCode': '11111'}},
                         'account': {'aps': {'id': 555}}})
         self.diskless_tenant = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         'COUNTRY': {'limit': 0},
                         'ENVIRONMENT': {'limit': 0},
                         'accountInfo': {'addressPostal': {'postalCode': '11111'}},
@@ -88,7 +89,7 @@ class TestTenant(TestCase):
         self.reprovisioning_tenant = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:provisioning',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         'COUNTRY': {'limit': 0},
                         'ENVIRONMENT': {'limit': 0},
                         'accountInfo': {'addressPostal': {'postalCode': '11111'}},
@@ -97,7 +98,7 @@ class TestTenant(TestCase):
         self.reprovisioned_tenant = \
             json.dumps({'aps': {'type': 'http://new.app', 'id': '123-123-123',
                                 'status': 'aps:ready',
-                                'subscription': '555'},
+                                'subscription': '777'},
                         'COUNTRY': {'limit': 0},
                         'ENVIRONMENT': {'limit': 0},
                         'accountInfo': {'addressPostal': {'postalCode': '11111'}},
@@ -113,10 +114,11 @@ class TestTenant(TestCase):
     def test_new_tenant(self, make_admin_mock, OA_mock):
         with setup_fb_client() as fb_client_mock:
             fb_admin_mock = make_admin_mock.return_value
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant',
                                    headers=self.headers,
                                    data=self.new_tenant)
@@ -126,16 +128,44 @@ class TestTenant(TestCase):
 
         assert res.status_code == 201
 
+    @bypass_auth
+    @patch('connector.v1.resources.tenant.remember_tenant')
+    @patch('connector.v1.resources.tenant.OA')
+    @patch('connector.v1.resources.tenant.make_default_fallball_admin')
+    def test_new_tenant_remembered_when_provisioned(self, make_admin_mock, OA_mock,
+                                                    remember_tenant_mock):
+        with setup_fb_client():
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
+            oa_response = MagicMock(status_code=500, text='Subscription failed')
+            OA_mock.subscribe_on.side_effect = OACommunicationException(oa_response)
+            with self.assertRaises(OACommunicationException):
+                self.client.post('/connector/v1/tenant',
+                                 headers=self.headers,
+                                 data=self.new_tenant)
+            remember_tenant_mock.assert_not_called()
+
+            OA_mock.subscribe_on.side_effect = None
+            res = self.client.post('/connector/v1/tenant',
+                                   headers=self.headers,
+                                   data=self.new_tenant)
+        assert res.status_code == 201
+        remember_tenant_mock.assert_called_once_with('123-123-123', 'fake_company_name')
+
     @bypass_auth
     @patch('connector.v1.resources.tenant.OA')
     @patch('connector.v1.resources.tenant.make_default_fallball_admin')
     def test_new_tenant_optional_params(self, make_admin_mock, OA_mock):
         with setup_fb_client() as fb_client_mock:
             fb_admin_mock = make_admin_mock.return_value
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant', headers=self.headers,
                                    data=self.new_tenant_no_params)
             fb_client_mock.create.assert_called()
@@ -148,8 +178,9 @@ class TestTenant(TestCase):
     @patch('connector.v1.resources.tenant.OA')
     def test_create_reprovisioned_tenant(self, OA_mock):
         with setup_fb_client() as fb_client_mock:
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company'},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company'},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant', headers=self.headers,
                                    data=self.reprovisioned_tenant)
             fb_client_mock.create.assert_not_called()
@@ -160,8 +191,9 @@ class TestTenant(TestCase):
     @patch('connector.v1.resources.tenant.OA')
     def test_create_client_reprovision_not_completed(self, OA_mock):
         with setup_fb_client() as fb_client_mock:
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company'},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company'},
+                '777': {'subscriptionId': 555}})
             headers = self.headers.copy()
             headers.update({'Aps-Request-Phase': 'async'})
             res = self.client.post('/connector/v1/tenant', headers=headers,
@@ -174,10 +206,11 @@ class TestTenant(TestCase):
     @patch('connector.v1.resources.tenant.OA')
     def test_new_tenant_no_email(self, OA_mock):
         with setup_fb_client() as fb_client_mock:
-            OA_mock.get_resource.side_effect = [
-                {'companyName': 'fake_company', 'techContact': {'email': 'tenant-tech@fallball.io'},
-                 'addressPostal': {'postalCode': '11111'}},
-                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'tenant-tech@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant', headers=self.headers,
                                    data=self.new_tenant_no_email)
             fb_client_mock.create.assert_called()
@@ -196,10 +229,11 @@ class TestTenant(TestCase):
             }
 
             fb_client_mock.create.side_effect = HttpClientError(response=response)
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact':
-                                                     {'email': 'new-tenant@fallball.io'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact':
+                            {'email': 'new-tenant@fallball.io'}},
+                '777': {'subscriptionId': 555}})
 
             res = self.client.post('/connector/v1/tenant',
                                    headers=self.headers,
@@ -221,10 +255,11 @@ class TestTenant(TestCase):
             }
 
             fb_client_mock.create.side_effect = HttpClientError(response=response)
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact':
-                                                     {'email': 'new-tenant@fallball.io'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact':
+                            {'email': 'new-tenant@fallball.io'}},
+                '777': {'subscriptionId': 555}})
 
             res = self.client.post('/connector/v1/tenant',
                                    headers=self.headers,
@@ -245,10 +280,11 @@ class TestTenant(TestCase):
             response.text = 'Something went wrong'
             response.status_code = 400
             fb_client_mock.create.side_effect = HttpClientError(response=response)
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant',
                                    headers=self.headers,
                                    data=self.new_tenant)
@@ -265,10 +301,11 @@ class TestTenant(TestCase):
             response.text = 'Something went wrong'
             response.status_code = 500
             fb_client_mock.create.side_effect = HttpServerError(response=response)
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant',
                                    headers=self.headers,
                                    data=self.new_tenant)
@@ -276,15 +313,32 @@ class TestTenant(TestCase):
 
         assert res.status_code == 500
 
+    @bypass_auth
+    @patch('connector.v1.resources.tenant.OA')
+    def test_new_tenant_fallball_unavailable(self, OA_mock):
+        with setup_fb_client() as fb_client_mock:
+            fb_client_mock.create.side_effect = UpstreamUnavailable('down', retry_after=5)
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
+            res = self.client.post('/connector/v1/tenant',
+                                   headers=self.headers,
+                                   data=self.new_tenant)
+
+        assert res.status_code == 503
+        assert res.headers['Retry-After'] == '5'
+
     @bypass_auth
     @patch('connector.v1.resources.tenant.OA')
     def test_new_fb_client_users(self, OA_mock):
         with setup_fb_client() as fb_client_mock:
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'},
-                                                 },
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             res = self.client.post('/connector/v1/tenant', headers=self.headers,
                                    data=self.fb_client_with_users)
             fb_client_mock.create.assert_called()
@@ -295,11 +349,11 @@ class TestTenant(TestCase):
     @patch('connector.v1.resources.tenant.OA')
     def test_new_fb_client_no_diskspace(self, OA_mock):
         with setup_fb_client() as fb_client_mock:
-            OA_mock.get_resource.side_effect = [{'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}
-                                                 },
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
             OA_mock.is_application_support_users.return_value = True
             res = self.client.post('/connector/v1/tenant', headers=self.headers,
                                    data=self.diskless_tenant)
@@ -435,10 +489,34 @@ class TestTenant(TestCase):
         assert res.status_code == 200
 
     def test_get_name_for_tenant(self):
+        get_name_for_tenant.cache.clear()
         with patch('connector.v1.resources.tenant.OA') as fake_oa:
             fake_oa.get_resource.return_value = {'tenantId': 'fake_client'}
             assert get_name_for_tenant('123-123-123') == 'fake_client'
 
+    @patch('connector.v1.resources.tenant.tenant_index')
+    @patch('connector.v1.resources.tenant.OA')
+    def test_get_name_for_tenant_persistent_index(self, OA_mock, tenant_index_mock):
+        get_name_for_tenant.cache.clear()
+        tenant_index_mock.get.return_value = 'indexed_client'
+        assert get_name_for_tenant('indexed_tenant') == 'indexed_client'
+        OA_mock.get_resource.assert_not_called()
+
+        tenant_index_mock.get.return_value = None
+        OA_mock.get_resource.return_value = {'tenantId': 'fake_client'}
+        assert get_name_for_tenant('new_tenant') == 'fake_client'
+        tenant_index_mock.set.assert_called_with('new_tenant', 'fake_client')
+
+    @bypass_auth
+    @patch('connector.v1.resources.tenant.tenant_index')
+    @patch('connector.v1.resources.tenant.get_name_for_tenant')
+    def test_delete_tenant_forgets_name(self, get_name_for_fb_client_mock, tenant_index_mock):
+        with setup_fb_client():
+            get_name_for_fb_client_mock.return_value = 'fake_client'
+            self.client.delete('/connector/v1/tenant/123', headers=self.headers)
+
+        tenant_index_mock.delete.assert_called_with('123')
+
     @patch('connector.v1.resources.tenant.OA')
     def test_get_name_for_fb_client_fail(self, OA_mock):
         OA_mock.get_resource.return_value = {}
@@ -489,9 +567,9 @@ class TestTenant(TestCase):
             OA_mock.get_counters.return_value = ['DEVICES', 'DISKSPACE', 'USERS']
             self.client.post('/connector/v1/tenant/123/onUsersChange',
                              headers=self.headers, data='{}')
-            OA_mock.send_request.assert_called_with('put',
-                                                    'aps/2/application/tenant/123',
-                                                    tenant)
+            OA_mock.send_later.assert_called_with('put',
+                                                  'aps/2/application/tenant/123',
+                                                  tenant)
 
             fb_client_mock.users_by_type['SILVER_USERS'] = 2
             OA_mock.get_user_resources.return_value = ['BRILLIANT_USERS', 'SILVER_USERS']
@@ -502,9 +580,9 @@ class TestTenant(TestCase):
 
             self.client.post('/connector/v1/tenant/123/onUsersChange',
                              headers=self.headers, data='{}')
-            OA_mock.send_request.assert_called_with('put',
-                                                    'aps/2/application/tenant/123',
-                                                    tenant)
+            OA_mock.send_later.assert_called_with('put',
+                                                  'aps/2/application/tenant/123',
+                                                  tenant)
 
     @bypass_auth
     @patch('connector.v1.resources.tenant.FbUser')
@@ -515,11 +593,12 @@ class TestTenant(TestCase):
                                 get_name_for_fb_client_mock, flask_g_mock,
                                 OA_mock, FbUser_mock):
         with setup_fb_client():
-            OA_mock.get_resource.side_effect = [json.loads(self.reprovisioning_tenant),
-                                                {'companyName': 'fake_company',
-                                                 'techContact': {'email': 'new-tenant@fallball.io'},
-                                                 'addressPostal': {'postalCode': '11111'}},
-                                                {'subscriptionId': 555}]
+            OA_mock.get_resource.side_effect = resources_by_id({
+                '123': json.loads(self.reprovisioning_tenant),
+                '555': {'companyName': 'fake_company',
+                        'techContact': {'email': 'new-tenant@fallball.io'},
+                        'addressPostal': {'postalCode': '11111'}},
+                '777': {'subscriptionId': 555}})
 
             OA_mock.get_counters.return_value = ['DEVICES', 'DISKSPACE', 'USERS']
 
@@ -551,9 +630,10 @@ class TestTenant(TestCase):
         provision_result_mock = provision_fb_client_mock.return_value
         provision_result_mock.status_code = 202
         provision_result_mock.body = {'statusData': {}}
-        OA_mock.get_resource.side_effect = [json.loads(self.reprovisioning_tenant),
-                                            {'companyName': 'fake_company'},
-                                            {'subscriptionId': 555}]
+        OA_mock.get_resource.side_effect = resources_by_id({
+            '123': json.loads(self.reprovisioning_tenant),
+            '555': {'companyName': 'fake_company'},
+            '777': {'subscriptionId': 555}})
 
         resp = self.client.post('/connector/v1/tenant/123/reprovision', headers=self.headers,
                                 data=self.reprovisioning_tenant)
@@ -576,9 +656,10 @@ class TestTenant(TestCase):
         provision_result_mock = provision_fb_client_mock.return_value
         provision_result_mock.status_code = 202
         provision_result_mock.body = {'statusData': {}}
-        OA_mock.get_resource.side_effect = [json.loads(self.reprovisioned_tenant),
-                                            {'companyName': 'fake_company'},
-                                            {'subscriptionId': 555}]
+        OA_mock.get_resource.side_effect = resources_by_id({
+            '123': json.loads(self.reprovisioned_tenant),
+            '555': {'companyName': 'fake_company'},
+            '777': {'subscriptionId': 555}})
 
         resp = self.client.post('/connector/v1/tenant/123/reprovision', headers=self.headers,
                                 data=self.reprovisioned_tenant)
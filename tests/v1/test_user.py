@@ -89,10 +89,11 @@ class TestUser(TestCase):
         fb_user_mock.client.name = 'fake_client'
         make_fallball_user_mock = self.user_service
         make_fallball_user_mock['userId'] = '3c9ed599-cd79-4222-beb0-be83f9dc8078'
-        OA_mock.get_resource.return_value = make_fallball_user_mock
-        OA_mock.get_resources.side_effect = [[self.oa_user], [self.new_tenant]]
+        OA_mock.get_user_service.return_value = dict(make_fallball_user_mock,
+                                                     user=self.oa_user)
         res = self.client.delete('/connector/v1/user/123', headers=self.headers)
         fb_user_mock.delete.assert_called()
+        OA_mock.get_user_service.assert_called_once_with('123')
         assert res.status_code == 204
 
     @bypass_auth
@@ -104,7 +105,7 @@ class TestUser(TestCase):
         fb_user_mock.client.name = 'fake_client'
         fb_user_mock.client.environment = 'TEST'
         fb_user_mock.client.country = 'US'
-        OA_user_mock.get_resources.return_value = [self.oa_user]
+        OA_user_mock.get_user_service.return_value = dict(self.user_service, user=self.oa_user)
         fb_user_mock.client.users_by_type = {
             'BRONZE_USERS': 1,
             'SILVER_USERS': 2
@@ -136,9 +137,9 @@ class TestUser(TestCase):
             'usage': 1,
             'limit': 1
         }
-        OA_mock.get_resources.return_value = [self.oa_user]
+        OA_mock.get_user_service.return_value = dict(self.user_service, user=self.oa_user)
         res = self.client.put('/connector/v1/user/123', headers=self.headers, data=user_payload)
-        OA_tenant_mock.send_request.assert_called()
+        OA_tenant_mock.send_later.assert_called()
         assert res.status_code == 200
 
     @bypass_auth
@@ -154,7 +155,7 @@ class TestUser(TestCase):
     @patch('connector.v1.resources.user.g')
     @patch('connector.v1.resources.user.get_name_for_tenant')
     def test_make_fallball_user(self, get_name_for_tenant_mock, flask_g_mock, OA_mock):
-        OA_mock.get_resource.return_value = self.user_service
+        OA_mock.get_user_service.return_value = self.user_service
         flask_g_mock.reseller = Reseller('fake_reseller')
         get_name_for_tenant_mock.return_value = 'fake_client'
         user = make_fallball_user('123-123-123')
@@ -1,6 +1,7 @@
 from mock import patch
 
 from connector.config import Config
+from connector.validator import OAuthResult
 
 config = Config()
 
@@ -8,15 +9,21 @@ config = Config()
 def bypass_auth(fn):
     # type: (object) -> object
     def test_wrapper(*args, **kwargs):
-        with patch('connector.v1.check_oauth_signature') as signature_mock, \
-                patch('connector.v1.get_client_key') as key_mock, \
+        with patch('connector.v1.verify_request') as verify_mock, \
                 patch('connector.v1.Reseller') as reseller_mock, \
                 patch('connector.v1.get_reseller_name') as reseller_name_mock:
-            signature_mock.return_value = True
+            verify_mock.return_value = OAuthResult(valid=True, client_key=config.oauth_key)
             reseller_name_mock.return_value = 'strategize-back-end-technologies'
-            key_mock.return_value = config.oauth_key
             instance = reseller_mock.return_value
             instance.reseller_name = '123-123-123'
             fn(*args, **kwargs)
 
     return test_wrapper
+
+
+def resources_by_id(resources):
+    # OA.get_resource side effect for calls that may run in parallel and in any order
+    def get_resource(resource_id, *args, **kwargs):
+        return resources[str(resource_id)]
+
+    return get_resource